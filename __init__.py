@@ -85,12 +85,20 @@ from email.mime import message, text
 
 import bpy
 import bmesh
+import gpu
+from gpu_extras.batch import batch_for_shader
 import os
 import math
 import re
 import uuid
-from mathutils import Vector
+import time
+import json
+import functools
+import wave
+import numpy as np
+from mathutils import Vector, Euler, Matrix
 from bpy import context
+from bpy.app.handlers import persistent
 from bpy.types import (Operator, Menu, Panel, UIList, PropertyGroup)
 from bpy.props import (StringProperty, BoolProperty, IntProperty, FloatProperty, EnumProperty, PointerProperty)
 
@@ -99,42 +107,107 @@ from bpy.props import (StringProperty, BoolProperty, IntProperty, FloatProperty,
 
 # Set Customs properties for rigs created by this Add-on
 def tag_rig_object(object, id, role):
-    if object is None: 
+    if object is None:
         return
     if object.type == 'ARMATURE':
         object["is_Atta_gp_face_rig"] = True
         object["rig_name"] = object.name
     object["rig_version"] = (0, 0, 1)  # Example versioning, can be updated as needed
-      
+
     object["rig_id"] = id  # Store the unique ID for the rig
     object["rig_role"] = role  # Store the role of the rig
+    register_rig_object(object, replace=True)
 
 def generate_unique_id(prefix="AttaGPFR"):
     no = str(uuid.uuid4())[:8]  # Shorten the UUID for readability
     return f"{prefix}_{no}"
 
+
+# Rig registry: rig_id -> {role -> object name}, plus the names of every face rig armature.
+# Built once per file (load_post) and kept current by the depsgraph handler, so lookups never walk bpy.data.objects.
+# Names are stored instead of objects because object pointers dont survive undo - every hit is re-validated
+# against the custom props, and a stale entry (rename/delete) triggers a single rebuild.
+_rig_registry = {}
+_face_rig_names = set()
+_rig_registry_state = {"dirty": True}
+
+def register_rig_object(obj, replace=False):
+    """Add or refresh a single tagged object in the rig registry.
+    A role that still resolves to another object keeps it unless replace is set, so a duplicate
+    (which copies the custom props) never takes over the original's role."""
+    rig_id = obj.get("rig_id")
+    role = obj.get("rig_role")
+    if rig_id is None or role is None:
+        return
+    roles = _rig_registry.setdefault(rig_id, {})
+    current = roles.get(role)
+    if replace or current is None or current == obj.name or _resolve_rig_object(current, rig_id, role) is None:
+        roles[role] = obj.name
+    if obj.type == 'ARMATURE' and obj.get("is_Atta_gp_face_rig"):
+        _face_rig_names.add(obj.name)
+
+def rebuild_rig_registry():
+    """Rebuild the rig registry with a full scan of bpy.data.objects"""
+    _rig_registry.clear()
+    _face_rig_names.clear()
+    for obj in bpy.data.objects:
+        register_rig_object(obj)
+    _rig_registry_state["dirty"] = False
+
+def ensure_rig_registry():
+    if _rig_registry_state["dirty"]:
+        rebuild_rig_registry()
+
+def _resolve_rig_object(name, rig_id, role):
+    obj = bpy.data.objects.get(name)
+    if obj and obj.get("rig_id") == rig_id and obj.get("rig_role") == role:
+        return obj
+    return None
+
+def _resolve_face_rig(name):
+    obj = bpy.data.objects.get(name)
+    if obj and obj.type == 'ARMATURE' and obj.get("is_Atta_gp_face_rig"):
+        return obj
+    return None
+
 def get_rig_objects(rig_id):
     """Get all objects belonging to a specific rig"""
-    return {
-        obj["rig_role"]: obj
-        for obj in bpy.data.objects
-        if obj.get("rig_id") == rig_id
-    }
+    ensure_rig_registry()
+    for _ in range(2):
+        objects = {}
+        for role, name in _rig_registry.get(rig_id, {}).items():
+            obj = _resolve_rig_object(name, rig_id, role)
+            if obj is None:
+                break
+            objects[role] = obj
+        else:
+            return objects
+        rebuild_rig_registry()
+    return objects
 
 def get_rig_object_by_role(rig_id, role):
     """Get a specific object by its role"""
-    for obj in bpy.data.objects:
-        if obj.get("rig_id") == rig_id and obj.get("rig_role") == role:
+    ensure_rig_registry()
+    for _ in range(2):
+        name = _rig_registry.get(rig_id, {}).get(role)
+        if name is None:
+            return None
+        obj = _resolve_rig_object(name, rig_id, role)
+        if obj is not None:
             return obj
+        rebuild_rig_registry()
     return None
 
 def find_all_face_rigs():
     """Find all face rig armatures in the scene"""
-    return [
-        obj for obj in bpy.data.objects
-        if obj.get("gp_face_rig") and obj.get("rig_role") == "armature"
-    ]
-    
+    ensure_rig_registry()
+    for _ in range(2):
+        rigs = [_resolve_face_rig(name) for name in sorted(_face_rig_names)]
+        if all(rigs):
+            return rigs
+        rebuild_rig_registry()
+    return [rig for rig in rigs if rig]
+
 def get_rig_id(rig_object):
     """Get the rig ID from a rig object"""
     if rig_object and rig_object.get("rig_id"):
@@ -143,10 +216,25 @@ def get_rig_id(rig_object):
 
 #Find the rig using custom properties rather than name to avoid issues with multiple rigs
 def find_rig(context):
-    for obj in bpy.data.objects:
-        if obj.type == 'ARMATURE' and obj.get("is_Atta_gp_face_rig"):
-            return obj
-    return None
+    rigs = find_all_face_rigs()
+    return rigs[0] if rigs else None
+
+@persistent
+def rig_registry_load_post(*args):
+    rebuild_rig_registry()
+
+@persistent
+def rig_registry_undo_post(*args):
+    _rig_registry_state["dirty"] = True
+
+@persistent
+def rig_registry_depsgraph_update_post(scene, depsgraph):
+    # Only look at the objects that actually changed - never the whole scene
+    if _rig_registry_state["dirty"] or not depsgraph.id_type_updated('OBJECT'):
+        return
+    for update in depsgraph.updates:
+        if isinstance(update.id, bpy.types.Object):
+            register_rig_object(update.id.original)
 
 def get_face_rig_from_selection(context):
     obj = context.active_object
@@ -169,42 +257,298 @@ def get_bone_distance(armature, bone1_name, bone2_name):
     distance = (world_pos1 - world_pos2).length
     return distance
 
+def find_view3d_region(context):
+    """First 3D viewport area and its main region, or (None, None) when running without a UI"""
+    screen = context.screen
+    if screen is None:
+        return None, None
+    for area in screen.areas:
+        if area.type == 'VIEW_3D':
+            for region in area.regions:
+                if region.type == 'WINDOW':
+                    return area, region
+    return None, None
+
+def view_front(context, frame_object=None):
+    """Look at the drawing from the front, and optionally frame an object. Does nothing in background mode."""
+    area, region = find_view3d_region(context)
+    if area is None:
+        return
+    with context.temp_override(area=area, region=region, space_data=area.spaces.active):
+        bpy.ops.view3d.view_axis(type='FRONT')
+        if frame_object is not None:
+            bpy.ops.view3d.view_selected(use_all_regions=False)
+
+
+# Ordered names of the mouth shapes on the control board, rebuilt only when the board membership changes
+_board_shape_cache = {"names": None, "total": -1}
+
+def invalidate_board_shapes():
+    _board_shape_cache["names"] = None
+    _ghost_geometry_cache.clear()
+
+def get_board_shape_names():
+    """Names of the GP mouth shape copies on the control board, in board order"""
+    collection = bpy.data.collections.get("Mouth Rig Control Board Objects")
+    if collection is None:
+        return ()
+    # Comparing the object count catches links and unlinks even before the depsgraph handler runs
+    if _board_shape_cache["names"] is None or _board_shape_cache["total"] != len(collection.objects):
+        _board_shape_cache["names"] = tuple(obj.name for obj in collection.objects if obj.type == 'GREASEPENCIL')
+        _board_shape_cache["total"] = len(collection.objects)
+    return _board_shape_cache["names"]
+
+def get_board_shapes():
+    shapes = [bpy.data.objects.get(name) for name in get_board_shape_names()]
+    if None in shapes:
+        # A shape was renamed or deleted since the list was cached
+        invalidate_board_shapes()
+        shapes = [bpy.data.objects.get(name) for name in get_board_shape_names()]
+    return shapes
+
+# Values the workflow panel shows, so draw doesn't scan the scene on every redraw
+_ui_state = {"dirty": True}
+_ui_msgbus_owner = object()
+
+def mark_ui_state_dirty(*args):
+    _ui_state["dirty"] = True
+
+def get_ui_state(context):
+    """Cached panel state, refreshed after a depsgraph or msgbus event marked it dirty"""
+    if _ui_state["dirty"]:
+        shape_names = get_board_shape_names()
+        face_rig = find_rig(context)
+        _ui_state.update(
+            dirty=False,
+            has_mouth_shapes=bool(shape_names),
+            shape_names=shape_names,
+            lattice_name="GPMouthLattice" if bpy.data.objects.get("GPMouthLattice") else None,
+            face_rig_name=face_rig.name if face_rig else None,
+        )
+    return _ui_state
+
+def subscribe_ui_state():
+    # Renames are not depsgraph updates, so they come in through the message bus
+    bpy.msgbus.clear_by_owner(_ui_msgbus_owner)
+    for key in ((bpy.types.Object, "name"), (bpy.types.Collection, "name")):
+        bpy.msgbus.subscribe_rna(key=key, owner=_ui_msgbus_owner, args=(), notify=mark_ui_state_dirty)
+
+@persistent
+def board_state_depsgraph_update_post(scene, depsgraph):
+    if depsgraph.id_type_updated('COLLECTION'):
+        invalidate_board_shapes()
+        _ui_state["dirty"] = True
+    elif depsgraph.id_type_updated('ARMATURE') or depsgraph.id_type_updated('LATTICE'):
+        _ui_state["dirty"] = True
+    if _ghost_geometry_cache and depsgraph.id_type_updated('GREASEPENCIL'):
+        # A board copy's strokes were edited, its ghost is rebuilt on the next onion update
+        for update in depsgraph.updates:
+            if update.is_updated_geometry and isinstance(update.id, bpy.types.Object):
+                _ghost_geometry_cache.pop(update.id.original.session_uid, None)
+
+# What the last onion update left on screen, so the next one only touches what changed
+_onion_state = {"pending": False, "synced": False, "count": 0, "shown": None, "opacity": None}
+
+def schedule_onion_update(delay=0.01):
+    """Queue an onion skin refresh. Requests made while one is pending are folded into it."""
+    if _onion_state["pending"]:
+        return
+    _onion_state["pending"] = True
+    bpy.app.timers.register(do_onion_update, first_interval=delay)
+
+def reset_onion_state():
+    # Visibility was changed outside the scheduler, the next update starts from a full pass
+    _onion_state.update(synced=False, shown=None, opacity=None)
+
+@persistent
+def board_state_reset_handler(*args):
+    # The ghosts and the overlay belong to the file (or undo step) that was left
+    invalidate_board_shapes()
+    _ghost_geometry_cache.clear()
+    remove_onion_overlay()
+    # A file load drops the pending (non-persistent) timer without running it, undo keeps it.
+    # Either way the next request schedules a fresh one
+    if bpy.app.timers.is_registered(do_onion_update):
+        bpy.app.timers.unregister(do_onion_update)
+    _onion_state["pending"] = False
+    reset_onion_state()
+    mark_ui_state_dirty()
+
+@persistent
+def ui_state_load_post(*args):
+    # Loading a file drops every message bus subscription
+    subscribe_ui_state()
+    settings = getattr(bpy.context.scene, "grease_pencil_face_rig_settings", None)
+    if settings is None or not settings.profile_operators:
+        remove_ops_counter()
+
+def update_profile_operators(self, context):
+    # The bpy.ops hook only stays installed while someone is profiling
+    if self.profile_operators:
+        install_ops_counter()
+    else:
+        remove_ops_counter()
+
 def update_onion_skinning(self, context):
-    # Pass a lambda so the timer gets a no-argument callable
-    bpy.app.timers.register(do_onion_update, first_interval=0.1)
+    reset_onion_state()
+    schedule_onion_update()
+
+# Multi-ghost onion skin: all neighbour shapes are drawn as one line batch from a viewport draw handler
+_onion_overlay = {"handler": None, "positions": None, "colors": None, "batch": None, "in_front": False}
+# board copy session_uid -> line segment endpoints of its strokes, in drawing space
+_ghost_geometry_cache = {}
+ONION_BEFORE_COLOR = (0.9, 0.25, 0.25)
+ONION_CURRENT_COLOR = (0.1, 0.1, 0.1)
+ONION_AFTER_COLOR = (0.25, 0.45, 0.9)
+
+def get_ghost_segments(obj):
+    """Pairs of points, one pair per stroke segment, for every layer of a board copy"""
+    # Keyed by session_uid rather than name, so a renamed copy or a new one reusing a name never gets stale strokes
+    segments = _ghost_geometry_cache.get(obj.session_uid)
+    if segments is not None:
+        return segments
+    chunks = []
+    for layer in obj.data.layers:
+        frame = layer.get_frame_at(bpy.context.scene.frame_current)
+        if frame is None and len(layer.frames):
+            frame = layer.frames[0]
+        if frame is None:
+            continue
+        drawing = frame.drawing
+        point_count = len(drawing.attributes["position"].data)
+        if point_count < 2:
+            continue
+        co = np.empty(point_count * 3, dtype=np.float32)
+        drawing.attributes["position"].data.foreach_get("vector", co)
+        co = co.reshape(-1, 3)
+        offsets = np.empty(len(drawing.strokes) + 1, dtype=np.int32)
+        drawing.curve_offsets.foreach_get("value", offsets)
+        # Every point joins the next one, except across the end of a stroke
+        keep = np.ones(point_count - 1, dtype=bool)
+        stroke_ends = offsets[1:-1]
+        keep[stroke_ends[(stroke_ends > 0) & (stroke_ends < point_count)] - 1] = False
+        starts = np.nonzero(keep)[0]
+        pairs = np.empty((len(starts) * 2, 3), dtype=np.float32)
+        pairs[0::2] = co[starts]
+        pairs[1::2] = co[starts + 1]
+        chunks.append(pairs)
+    segments = np.concatenate(chunks) if chunks else np.empty((0, 3), dtype=np.float32)
+    _ghost_geometry_cache[obj.session_uid] = segments
+    return segments
+
+def tag_view3d_redraw():
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == 'VIEW_3D':
+                area.tag_redraw()
+
+def draw_onion_overlay():
+    positions = _onion_overlay["positions"]
+    if positions is None or not len(positions):
+        return
+    shader = gpu.shader.from_builtin('POLYLINE_SMOOTH_COLOR')
+    if _onion_overlay["batch"] is None:
+        _onion_overlay["batch"] = batch_for_shader(shader, 'LINES', {"pos": positions, "color": _onion_overlay["colors"]})
+
+    # Ghosts sit where the shapes were drawn, slightly in front of or behind the drawing plane
+    gp_obj = bpy.data.objects.get("GP Temp Face Object")
+    matrix = gp_obj.matrix_world if gp_obj else Matrix.Identity(4)
+    matrix = Matrix.Translation((0, -0.1 if _onion_overlay["in_front"] else 0.1, 0)) @ matrix
+
+    gpu.state.blend_set('ALPHA')
+    gpu.state.depth_test_set('NONE' if _onion_overlay["in_front"] else 'LESS_EQUAL')
+    with gpu.matrix.push_pop():
+        gpu.matrix.multiply_matrix(matrix)
+        shader.uniform_float("viewportSize", gpu.state.viewport_get()[2:])
+        shader.uniform_float("lineWidth", 2.0)
+        _onion_overlay["batch"].draw(shader)
+    gpu.state.depth_test_set('NONE')
+    gpu.state.blend_set('NONE')
+
+def remove_onion_overlay():
+    if _onion_overlay["handler"] is not None:
+        bpy.types.SpaceView3D.draw_handler_remove(_onion_overlay["handler"], 'WINDOW')
+    _onion_overlay.update(handler=None, positions=None, colors=None, batch=None)
+
+def update_onion_overlay(settings, gp_duplicates, idx):
+    """Rebuild the ghost batch around shape idx, or drop it when idx is None"""
+    if idx is None:
+        if _onion_overlay["handler"] is not None:
+            remove_onion_overlay()
+            tag_view3d_redraw()
+        return
+
+    chunks = []
+    colors = []
+    for distance in range(settings.onion_range + 1):
+        alpha = settings.onion_opacity * settings.onion_falloff ** distance
+        neighbours = ((idx, ONION_CURRENT_COLOR),) if distance == 0 else \
+            ((idx - distance, ONION_BEFORE_COLOR), (idx + distance, ONION_AFTER_COLOR))
+        for neighbour, tint in neighbours:
+            if 0 <= neighbour < len(gp_duplicates):
+                segments = get_ghost_segments(gp_duplicates[neighbour])
+                chunks.append(segments)
+                colors.append(np.tile(np.array((*tint, alpha), dtype=np.float32), (len(segments), 1)))
+
+    _onion_overlay["positions"] = np.concatenate(chunks) if chunks else None
+    _onion_overlay["colors"] = np.concatenate(colors) if colors else None
+    _onion_overlay["batch"] = None
+    _onion_overlay["in_front"] = settings.onion_placement == 'FRONT'
+    if _onion_overlay["handler"] is None:
+        _onion_overlay["handler"] = bpy.types.SpaceView3D.draw_handler_add(draw_onion_overlay, (), 'WINDOW', 'POST_VIEW')
+    tag_view3d_redraw()
+
+def hide_onion(obj):
+    obj.hide_set(True)
+    obj.hide_viewport = True
+    apply_onion_opacity(obj, 1.0)
 
 def do_onion_update():
-    
+    _onion_state["pending"] = False
     context = bpy.context
     settings = context.scene.grease_pencil_face_rig_settings
-    collection = bpy.data.collections.get("Mouth Rig Control Board Objects")
-    
-    if not collection:
+    if not bpy.data.collections.get("Mouth Rig Control Board Objects"):
+        reset_onion_state()
+        update_onion_overlay(settings, [], None)
         return None
     
-    gp_duplicates = [
-        obj for obj in collection.objects 
-        if obj and obj.type == 'GREASEPENCIL'
-    ]
-
-    # Always hide and reset everything
-    for obj in gp_duplicates:
-        obj.hide_set(True)
-        obj.hide_viewport = True
-        for layer in obj.data.layers:
-            layer.opacity = 1.0
-
-    if not settings.use_onion_skinning or not gp_duplicates:
-        return None
-
-    # Show the selected onion skin
-    idx = max(0, min(settings.onion_preview_index, len(gp_duplicates) - 1))
-    onion = gp_duplicates[idx]
-    onion.hide_set(False)
-    onion.hide_viewport = False
-    onion.location = (0, 0.1, 0)  # Slightly offset in y to avoid z-fighting
-    apply_onion_opacity(onion, settings.onion_opacity)
-    
+    gp_duplicates = get_board_shapes()
+
+    shown = bpy.data.objects.get(_onion_state["shown"]) if _onion_state["shown"] else None
+    if not _onion_state["synced"] or _onion_state["count"] != len(gp_duplicates) or (_onion_state["shown"] and shown is None):
+        # Hide and reset everything once, later updates only swap the ghost
+        for obj in gp_duplicates:
+            hide_onion(obj)
+        shown = None
+        _onion_state.update(synced=True, count=len(gp_duplicates), opacity=None)
+
+    onion = None
+    overlay_idx = None
+    if settings.use_onion_skinning and gp_duplicates:
+        idx = max(0, min(settings.onion_preview_index, len(gp_duplicates) - 1))
+        if settings.onion_mode == 'MULTI':
+            # The neighbours are drawn by the overlay, no board copy gets unhidden
+            overlay_idx = idx
+        else:
+            onion = gp_duplicates[idx]
+    update_onion_overlay(settings, gp_duplicates, overlay_idx)
+
+    if shown is not None and shown != onion:
+        hide_onion(shown)
+        shown = None
+
+    if onion is not None:
+        if shown is None:
+            # Show the selected onion skin
+            onion.hide_set(False)
+            onion.hide_viewport = False
+            onion.location = (0, 0.1, 0)  # Slightly offset in y to avoid z-fighting
+            _onion_state["opacity"] = None
+        if _onion_state["opacity"] != settings.onion_opacity:
+            apply_onion_opacity(onion, settings.onion_opacity)
+            _onion_state["opacity"] = settings.onion_opacity
+
+    _onion_state["shown"] = onion.name if onion else None
     return None  # unregisters timer after one run
 
 
@@ -216,15 +560,7 @@ def apply_onion_opacity(ghost_obj, opacity):
 
 
 def get_onion_max(self):
-    collection = bpy.data.collections.get("Mouth Rig Control Board Objects")
-    if not collection:
-        return 0
-    count = len([
-        obj for obj in collection.objects
-        if obj and obj.type == 'GREASEPENCIL'
-        
-    ])
-    return max(0, count -1 )
+    return max(0, len(get_board_shape_names()) - 1)
 
 def get_onion_index(self):
     # Clamp stored value to valid range
@@ -233,22 +569,67 @@ def get_onion_index(self):
 
 # update callback on the index property also just calls the same function
 def update_onion_index(self, context):
-    
-    
-    bpy.app.timers.register(do_onion_update, first_interval=0.01)
+    schedule_onion_update()
     
 def set_onion_index(self, value):
     max_val = get_onion_max(self)
     self["onion_preview_index"] = max(0, min(value, max_val))
     # Trigger the update manually since get/set bypasses update callback
-    bpy.app.timers.register(do_onion_update, first_interval=0.01)
+    schedule_onion_update()
 
 
 def update_onion_opacity(self, context):
-    bpy.app.timers.register(do_onion_update, first_interval=0.01)
-
-
-
+    schedule_onion_update()
+
+
+
+
+
+# Name of one Grease Pencil layer a mouth shape was drawn on
+class MouthShapeLayer(bpy.types.PropertyGroup):
+    pass
+
+# One finished mouth shape. The item name is the shape name.
+# Kept on the scene while drawing and copied to the rig armature when the rig is created.
+class MouthShapeItem(bpy.types.PropertyGroup):
+    gp_object: bpy.props.PointerProperty(name="Board Copy", type=bpy.types.Object)
+    layer_names: bpy.props.CollectionProperty(type=MouthShapeLayer)
+    frame_number: bpy.props.IntProperty(name="Frame Number", default=1)
+    board_slot: bpy.props.IntProperty(name="Board Slot", default=-1)
+    bone_name: bpy.props.StringProperty(name="Bone Name", default="")
+
+
+def add_shape_record(records, name, gp_object, layer_names=(), frame_number=1):
+    record = records.add()
+    record.name = name
+    record.gp_object = gp_object
+    record.frame_number = frame_number
+    for layer_name in layer_names:
+        record.layer_names.add().name = layer_name
+    return record
+
+def copy_shape_records(source, target):
+    """Append every record of one shape collection to another"""
+    for record in source:
+        copy = add_shape_record(target, record.name, record.gp_object,
+                                [item.name for item in record.layer_names], record.frame_number)
+        copy.board_slot = record.board_slot
+        copy.bone_name = record.bone_name
+
+def ensure_shape_records(scene, collection, gp_obj):
+    """Create records for board copies finished before shapes were recorded, matching each layer once by name"""
+    records = scene.gp_mouth_shapes
+    missing = [obj for obj in collection.objects
+               if obj.type == 'GREASEPENCIL' and obj.name not in records
+               and not any(record.gp_object == obj for record in records)]
+    if not missing:
+        return
+    layers_by_shape = {}
+    for layer in gp_obj.data.layers:
+        # Layers renamed to an existing name get a ".001" style suffix
+        layers_by_shape.setdefault(re.sub(r"\.\d+$", "", layer.name), []).append(layer.name)
+    for obj in missing:
+        add_shape_record(records, obj.name, obj, layers_by_shape.get(obj.name, ()))
 
 
 # Main property group for the add-on, storing all relevant settings for the face rig creation and editing process.
@@ -279,7 +660,7 @@ class GreasePencilFaceRigSettings(bpy.types.PropertyGroup):
         default=0.3,
         min=0.0,
         max=1.0,
-        update=update_onion_skinning
+        update=update_onion_opacity
     )
     onion_preview_index: bpy.props.IntProperty(
         name="Preview Shape",
@@ -289,6 +670,84 @@ class GreasePencilFaceRigSettings(bpy.types.PropertyGroup):
         set=set_onion_index,
         update=update_onion_index
     )
+    onion_mode: bpy.props.EnumProperty(
+        name="Onion Mode",
+        description="How many finished shapes the onion preview shows",
+        items=[('SINGLE', "Single", "Show the chosen shape only"),
+               ('MULTI', "Neighbours", "Show the shapes before and after the chosen one, fading with distance")],
+        default='SINGLE',
+        update=update_onion_skinning
+    )
+    onion_range: bpy.props.IntProperty(
+        name="Range",
+        description="Number of shapes shown on each side of the chosen one",
+        default=2,
+        min=1,
+        max=10,
+        update=update_onion_opacity
+    )
+    onion_falloff: bpy.props.FloatProperty(
+        name="Falloff",
+        description="Opacity kept for every step away from the chosen shape",
+        default=0.5,
+        min=0.05,
+        max=1.0,
+        update=update_onion_opacity
+    )
+    onion_placement: bpy.props.EnumProperty(
+        name="Placement",
+        description="Draw the ghosts in front of or behind the current drawing",
+        items=[('BEHIND', "Behind", "Ghosts are hidden by what is in front of them"),
+               ('FRONT', "In Front", "Ghosts are drawn over everything")],
+        default='BEHIND',
+        update=update_onion_opacity
+    )
+    shape_switch_mode: bpy.props.EnumProperty(
+        name="Shape Switching",
+        description="How the rig decides which mouth shape layer is visible",
+        items=[('DISTANCE', "Per-Layer Distance", "Every layer driver compares its shape bone with the puck (4 transform lookups per layer)"),
+               ('INDEX', "Shape Index", "The puck drives one integer shape index on the armature, layer drivers only compare against it"),
+               ('FRAMES', "Shape Frames", "Every shape is a keyframe on one layer, picked by a Time Offset modifier driven by the puck. Choose before drawing"),
+               ('GEONODES', "Geometry Nodes", "A Geometry Nodes modifier keeps only the layers of the active shape index, no per-layer drivers")],
+        default='DISTANCE'
+    )
+    profile_operators: bpy.props.BoolProperty(
+        name="Profile Operators",
+        description="Record time, bpy.ops calls, mode switches and new datablocks for every add-on operator",
+        default=False,
+        update=update_profile_operators
+    )
+    profile_log: bpy.props.BoolProperty(
+        name="Write Log",
+        description="Append every profiled operator run to a JSON Lines file",
+        default=False
+    )
+    profile_log_path: bpy.props.StringProperty(
+        name="Log File",
+        description="JSON Lines file the operator profiles are appended to",
+        default="//gp_face_rig_profile.jsonl",
+        subtype='FILE_PATH'
+    )
+    merge_shape_labels: bpy.props.BoolProperty(
+        name="Merge Shape Labels",
+        description="When done drawing, bake the shape name labels into one mesh instead of keeping one text object per shape",
+        default=False
+    )
+    board_columns: bpy.props.IntProperty(
+        name="Board Columns",
+        description="Shapes per row on the control board, 0 picks the count that keeps the board closest to square",
+        default=4,
+        min=0,
+        max=32
+    )
+    board_padding: bpy.props.FloatProperty(
+        name="Board Padding",
+        description="Space left between the largest shape and the edge of its slot on the control board",
+        default=0.05,
+        min=0.0,
+        max=1.0,
+        subtype='DISTANCE'
+    )
     Eye_shape_name: str
     Eye_shape_name: bpy.props.StringProperty(
         name="Eye Shape Name",
@@ -395,7 +854,7 @@ class SetUp(bpy.types.Operator):
             self.report({'WARNING'}, "Please switch to Object Mode to run setup.")
             return {'CANCELLED'}
         bpy.ops.object.select_all(action='DESELECT')
-        bpy.ops.view3d.view_axis(type='FRONT')
+        view_front(context)
         # Collection handling
         collection_name = "Temp Drawing Collection"
         if collection_name not in bpy.data.collections:
@@ -419,6 +878,7 @@ class SetUp(bpy.types.Operator):
         gp_mat.grease_pencil.color = (0, 0, 0, 1)    
         
             
+        context.scene.gp_mouth_shapes.clear()
         context.scene.has_setup_been_run = True
         
         return {'FINISHED'}
@@ -694,7 +1154,7 @@ class ViewCenterOriginMouths(bpy.types.Operator):
             obj.select_set(False)
         
         context.scene.gp_face_mode = 'MOUTHS'
-        bpy.ops.view3d.view_axis(type='FRONT')
+        view_front(context)
 
         # Collection handling -- Move these to set up
         collection_name = "Temp Drawing Collection"
@@ -739,6 +1199,9 @@ class ViewCenterOriginMouths(bpy.types.Operator):
         # How to access tool menu--
         bpy.context.scene.tool_settings.gpencil_sculpt.use_scale_thickness = True
         bpy.ops.object.mode_set(mode='PAINT_GREASE_PENCIL')
+        if context.scene.grease_pencil_face_rig_settings.shape_switch_mode == 'FRAMES':
+            # Frame mode draws every shape on this layer, one keyframe per shape starting at frame 1
+            context.scene.frame_current = 1
         new_layer = gp_obj.data.layers.new(name="New GP Layer", set_active=True)
         new_layer.name = "New GP Layer"  # Optional: set a name for the layer
         new_layer.frames.new(frame_number=1)  # Ensure there's a frame to draw on
@@ -772,15 +1235,7 @@ class ViewCenterOriginMouths(bpy.types.Operator):
     def zoom_to_object(self, obj):
         bpy.context.view_layer.objects.active = obj
         obj.select_set(True)
-        for area in bpy.context.screen.areas:
-            if area.type == 'VIEW_3D':
-                for region in area.regions:
-                    if region.type == 'WINDOW':
-                        with bpy.context.temp_override(area=area, region=region, space_data=area.spaces.active):
-                            bpy.ops.view3d.view_axis(type = 'FRONT')
-                            bpy.ops.view3d.view_selected(use_all_regions=False)
-                        
-                            break
+        view_front(bpy.context, obj)
         obj.hide_select = True
 
     def make_plane_unselectable(self, obj):
@@ -803,6 +1258,206 @@ class ViewCenterOriginMouths(bpy.types.Operator):
 
 
 
+def iter_drawings(gp_data, layer_names=None):
+    """Every drawing on every keyframe of every layer, or only of the layers in layer_names"""
+    for layer in gp_data.layers:
+        if layer_names is not None and layer.name not in layer_names:
+            continue
+        for frame in layer.frames:
+            if frame.drawing is not None:
+                yield frame.drawing
+
+def assign_vertex_group_to_all_points(context, gp_obj, vgroup_name, weight=1.0, layer_names=None):
+    """Weight every point of every drawing, or only of the layers in layer_names, to vgroup_name.
+    Grease Pencil drawings keep their weights in one deform layer that the Python API doesn't expose
+    (drawing.attributes never lists vertex groups), so this is one edit mode assign across all keyframes."""
+    if vgroup_name not in gp_obj.vertex_groups:
+        gp_obj.vertex_groups.new(name=vgroup_name)
+    if not any(len(drawing.attributes["position"].data) for drawing in iter_drawings(gp_obj.data, layer_names)):
+        return
+
+    tool_settings = context.scene.tool_settings
+    use_multi_frame = tool_settings.use_grease_pencil_multi_frame_editing
+    vertex_group_weight = tool_settings.vertex_group_weight
+    # Only the layers being assigned are shown, so select_all only picks up their points
+    layer_hide = {layer.name: layer.hide for layer in gp_obj.data.layers}
+    for layer in gp_obj.data.layers:
+        layer.hide = layer_names is not None and layer.name not in layer_names
+    gp_obj.vertex_groups.active_index = gp_obj.vertex_groups[vgroup_name].index
+    tool_settings.use_grease_pencil_multi_frame_editing = True
+    tool_settings.vertex_group_weight = weight
+    try:
+        with context.temp_override(active_object=gp_obj, object=gp_obj):
+            bpy.ops.object.mode_set(mode='EDIT')
+            bpy.ops.grease_pencil.select_all(action='SELECT')
+            bpy.ops.object.vertex_group_assign()
+            bpy.ops.object.mode_set(mode='OBJECT')
+    finally:
+        # Leave the user's tool settings and layer visibility as they were
+        tool_settings.use_grease_pencil_multi_frame_editing = use_multi_frame
+        tool_settings.vertex_group_weight = vertex_group_weight
+        for layer in gp_obj.data.layers:
+            layer.hide = layer_hide[layer.name]
+
+# foreach field, values per element and numpy type used to copy each attribute data type in bulk
+ATTRIBUTE_ARRAY_FORMATS = {
+    'FLOAT': ("value", 1, np.float32),
+    'INT': ("value", 1, np.int32),
+    'INT8': ("value", 1, np.int32),
+    'BOOLEAN': ("value", 1, bool),
+    'FLOAT2': ("vector", 2, np.float32),
+    'INT32_2D': ("value", 2, np.int32),
+    'FLOAT_VECTOR': ("vector", 3, np.float32),
+    'FLOAT_COLOR': ("color", 4, np.float32),
+    'BYTE_COLOR': ("color", 4, np.float32),
+    'QUATERNION': ("value", 4, np.float32),
+    'FLOAT4X4': ("value", 16, np.float32),
+}
+
+def copy_drawing(source, target, matrix=None):
+    """Append every stroke of source to target, one bulk read and write per attribute.
+    matrix (4x4) optionally transforms the copied positions, and scales the radii by its uniform scale."""
+    stroke_count = len(source.strokes)
+    if not stroke_count:
+        return
+    offsets = np.empty(stroke_count + 1, dtype=np.int32)
+    source.curve_offsets.foreach_get("value", offsets)
+    positions = target.attributes.get("position")
+    starts = {'POINT': len(positions.data) if positions else 0, 'CURVE': len(target.strokes)}
+    target.add_strokes(np.diff(offsets).tolist())
+    if matrix is not None:
+        matrix = np.asarray(matrix, dtype=np.float32)
+        radius_scale = abs(np.linalg.det(matrix[:3, :3])) ** (1 / 3)
+
+    for attribute in source.attributes:
+        array_format = ATTRIBUTE_ARRAY_FORMATS.get(attribute.data_type)
+        # Internal attributes (selection and the like) stay behind
+        if array_format is None or attribute.name.startswith(".") or attribute.domain not in starts:
+            continue
+        field, width, dtype = array_format
+        values = np.empty(len(attribute.data) * width, dtype=dtype)
+        attribute.data.foreach_get(field, values)
+        if matrix is not None and attribute.name == "position":
+            values = (values.reshape(-1, 3) @ matrix[:3, :3].T + matrix[:3, 3]).ravel()
+        elif matrix is not None and attribute.name == "radius":
+            values = values * radius_scale
+
+        target_attribute = target.attributes.get(attribute.name)
+        if target_attribute is None:
+            target_attribute = target.attributes.new(attribute.name, attribute.data_type, attribute.domain)
+        start = starts[attribute.domain] * width
+        if start:
+            # Appending to existing strokes - keep their values
+            merged = np.empty(len(target_attribute.data) * width, dtype=dtype)
+            target_attribute.data.foreach_get(field, merged)
+            merged[start:start + len(values)] = values
+            values = merged
+        target_attribute.data.foreach_set(field, values)
+    target.tag_positions_changed()
+
+# Layer settings that change how a drawing looks, copied along with it
+LAYER_LOOK_PROPERTIES = ("opacity", "blend_mode", "tint_color", "tint_factor", "use_lights", "use_masks")
+LAYER_TRANSFORM_PROPERTIES = ("translation", "rotation", "scale")
+
+def copy_layer_properties(source, target, transform=True):
+    properties = LAYER_LOOK_PROPERTIES + LAYER_TRANSFORM_PROPERTIES if transform else LAYER_LOOK_PROPERTIES
+    for prop in properties:
+        setattr(target, prop, getattr(source, prop))
+
+def copy_layer_masks(context, gp_obj, layer_pairs):
+    """Give each target layer the masks of its source layer, for the mask layers gp_obj has.
+    Masks can only be added by operator, on the active layer."""
+    active = gp_obj.data.layers.active
+    for source, target in layer_pairs:
+        for mask in source.mask_layers:
+            if mask.name not in gp_obj.data.layers:
+                continue
+            gp_obj.data.layers.active = target
+            with context.temp_override(active_object=gp_obj, object=gp_obj):
+                bpy.ops.grease_pencil.layer_mask_add(name=mask.name)
+            target.mask_layers[-1].invert = mask.invert
+            target.mask_layers[-1].hide = mask.hide
+    if active is not None:
+        gp_obj.data.layers.active = active
+
+def copy_gp_layers(gp_obj, name, layer_names, frame_number=1):
+    """New Grease Pencil object with a copy of each named layer's drawing at frame_number, keyed on frame 1.
+    The layers keep their look, transform and masks and the materials are shared with gp_obj,
+    no other layer, keyframe, modifier or driver comes along."""
+    gp_data = bpy.data.grease_pencils.new(name)
+    for material in gp_obj.data.materials:
+        gp_data.materials.append(material)
+    layer_pairs = []
+    for layer_name in layer_names:
+        source_layer = gp_obj.data.layers.get(layer_name)
+        if source_layer is None:
+            continue
+        layer = gp_data.layers.new(layer_name)
+        copy_layer_properties(source_layer, layer)
+        layer_pairs.append((source_layer, layer))
+        frame = layer.frames.new(1)
+        source_frame = source_layer.get_frame_at(frame_number)
+        if source_frame is not None:
+            copy_drawing(source_frame.drawing, frame.drawing)
+    copy = bpy.data.objects.new(name, gp_data)
+    copy_layer_masks(bpy.context, copy, layer_pairs)
+    return copy
+
+
+# Room kept under every shape for its name label
+BOARD_LABEL_HEIGHT = 0.06
+# Distance switching shows a shape while the puck is within 0.1 of its bone, so slots are never closer than this
+BOARD_MIN_SPACING = 0.2
+# Top left corner of the control board
+BOARD_TOP_LEFT = (.9, .5)
+
+def drawing_bounds(gp_obj):
+    """(min_x, min_z, max_x, max_z) of every stroke point of a Grease Pencil object around its origin,
+    or None when it has no points"""
+    chunks = []
+    for drawing in iter_drawings(gp_obj.data):
+        positions = drawing.attributes["position"]
+        point_count = len(positions.data)
+        if not point_count:
+            continue
+        co = np.empty(point_count * 3, dtype=np.float32)
+        positions.data.foreach_get("vector", co)
+        chunks.append(co.reshape(-1, 3)[:, (0, 2)])
+    if not chunks:
+        return None
+    points = np.concatenate(chunks) * (gp_obj.scale.x, gp_obj.scale.z)
+    return (*points.min(axis=0), *points.max(axis=0))
+
+def layout_shape_board(bounds, columns=4, padding=0.05):
+    """Uniform slot grid that fits every shape, centered on its origin, with room for its label underneath.
+    bounds holds drawing_bounds() per shape, columns=0 picks the count that keeps the board closest to square.
+    Returns the first slot's position and the spacing in world X/Z, columns, rows, the board's top left corner
+    and size, and where the labels go relative to their shape."""
+    extents = np.array([b for b in bounds if b is not None] or [(-.05, -.05, .05, .05)], dtype=np.float64)
+    half_width = np.abs(extents[:, (0, 2)]).max()
+    half_height = np.abs(extents[:, (1, 3)]).max()
+    spacing_x = max(2 * half_width + padding, BOARD_MIN_SPACING)
+    cell_height = 2 * half_height + BOARD_LABEL_HEIGHT + padding
+    spacing_z = max(cell_height, BOARD_MIN_SPACING)
+
+    count = max(len(bounds), 1)
+    if columns <= 0:
+        columns = max(1, math.ceil(math.sqrt(count * spacing_z / spacing_x)))
+    rows = math.ceil(count / columns)
+    left, top = BOARD_TOP_LEFT
+    # Any height added to reach the minimum spacing is split above and below the shape
+    top_gap = (padding + spacing_z - cell_height) / 2
+    return {
+        "slot_origin": (left + spacing_x / 2, top - top_gap - half_height),
+        "slot_spacing": (spacing_x, spacing_z),
+        "columns": columns,
+        "rows": rows,
+        "top_left": (left, top),
+        "size": (columns * spacing_x, rows * spacing_z),
+        "label_offset": -(half_height + BOARD_LABEL_HEIGHT / 2),
+    }
+
+
 class FinishMouthShape(bpy.types.Operator):
     """Duplicate the GP object, scale it, move it, and prepare the original for new drawing"""
     bl_idname = "grease_pencil.finish_mouth_shape"
@@ -838,20 +1493,22 @@ class FinishMouthShape(bpy.types.Operator):
         if not gp_obj or gp_obj.type != 'GREASEPENCIL':
             self.report({'ERROR'}, "Active object is not a Grease Pencil object.")
             return {'CANCELLED'}
-        #Check for dupplicate names in the collection
+        #Check for dupplicate names in the shape records and on the board
         collection = bpy.data.collections.get("Mouth Rig Control Board Objects")
-        if collection:
-            
-            for obj in collection.objects:
-                if obj.name == mouth_name:
-                    self.report({'WARNING'}, f"A shape with the name '{mouth_name}' already exists. Please choose a different name.")
-                    return {'CANCELLED'}
+        if mouth_name in context.scene.gp_mouth_shapes or (collection and collection.objects.get(mouth_name)):
+            self.report({'WARNING'}, f"A shape with the name '{mouth_name}' already exists. Please choose a different name.")
+            return {'CANCELLED'}
         
-        # if settings.use_framemode:
-        #     return self.finish_mouth_shape_frame_mode(context, gp_obj, mouth_name)
-        # else:
-        #     return self.finish_mouth_shape_layer_mode(context, gp_obj, mouth_name)
-    
+        # Frame mode keeps every shape as a keyframe on one layer instead of one layer per shape
+        frame_mode = settings.shape_switch_mode == 'FRAMES'
+        current_frame = context.scene.frame_current
+        if frame_mode:
+            layer = gp_obj.data.layers.active
+            frame = layer.get_frame_at(current_frame) if layer else None
+            if not frame or frame.frame_number != current_frame or not len(frame.drawing.strokes):
+                self.report({'WARNING'}, f"No shape drawn on frame {current_frame} of the active layer")
+                return {'CANCELLED'}
+
         if gp_obj and gp_obj.type == 'GREASEPENCIL':
             # Check if all visible layers are empty
             all_empty = True
@@ -863,57 +1520,15 @@ class FinishMouthShape(bpy.types.Operator):
             if all_empty:
                 self.report({'WARNING'}, "No shapes drawn in visible layers")
                 return {'CANCELLED'}
-            for layer in gp_obj.data.layers:
-                if not layer.hide:
-                    layer.name = mouth_name
-            # Duplicate the Grease Pencil object
+            if not frame_mode:
+                for layer in gp_obj.data.layers:
+                    if not layer.hide:
+                        layer.name = mouth_name
+                shape_layers = [layer.name for layer in gp_obj.data.layers if not layer.hide]
+            else:
+                shape_layers = [gp_obj.data.layers.active.name]
             bpy.ops.object.mode_set(mode='OBJECT')
             bpy.ops.object.select_all(action='DESELECT')
-            gp_obj.select_set(True)
-            bpy.ops.object.duplicate()
-            gp_duplicate = context.active_object
-            # Set gp_duplicate name to the provided mouth shape name
-            gp_duplicate.name = mouth_name
-            for layer in gp_duplicate.data.layers:
-                if layer.hide:
-                    #Deletes all layers that are hidden
-                    gp_duplicate.data.layers.remove(layer)
-            
-        #assign each dup layer to vertex group for eventual bone parenting 
-    
-            if gp_duplicate and gp_duplicate.type == 'GREASEPENCIL':
-            # Create or get the vertex group
-                vgroup_name = mouth_name + " Shape Bone"
-                if vgroup_name not in gp_duplicate.vertex_groups:
-                    gp_duplicate.vertex_groups.new(name=vgroup_name)
-                # Enter edit mode
-                bpy.ops.object.mode_set(mode='EDIT')
-#                # Reveal all existing layers in the original GP object
-#                for layer in gp_duplicate.data.layers:
-#                    layer.hide = False
-                # Select all strokes
-                
-                bpy.ops.grease_pencil.select_all(action='SELECT')
-                # Assign selected vertices to the vertex group
-                for area in bpy.context.screen.areas:
-                    if area.type == 'VIEW_3D':
-                        for region in area.regions:
-                            if region.type == 'WINDOW':
-                                
-                                with bpy.context.temp_override(
-                                        area=area,
-                                        region=region,
-                                        edit_object=bpy.context.edit_object
-                                ):
-                                    bpy.ops.object.vertex_group_assign()
-                                break
-                bpy.ops.object.mode_set(mode='OBJECT')
-                self.report({'INFO'}, "Vertices added to mouth controller vertex group.")
-
-            # Scale the duplicate
-            # Gonna need to do this later
-            #gp_duplicate.scale *= 2.5
-            #bpy.ops.object.transform_apply(location=False, rotation=False, scale=True)
 
             # Create or get the "Mouth Rig Control Board Objects" collection within "Temp Drawing Collection"
             parent_collection_name = "Temp Drawing Collection"
@@ -933,8 +1548,21 @@ class FinishMouthShape(bpy.types.Operator):
                 if new_collection.name not in parent_collection.children:
                     parent_collection.children.link(new_collection)
 
-            
-            
+            # Copy only the shape's layers, as drawn on this frame, into a new object held from frame 1.
+            # Unlike duplicating the whole object this never touches the shapes finished before it
+            gp_duplicate = copy_gp_layers(gp_obj, mouth_name, shape_layers, current_frame)
+            gp_duplicate.matrix_world = gp_obj.matrix_world.copy()
+            new_collection.objects.link(gp_duplicate)
+
+        #assign each dup layer to vertex group for eventual bone parenting 
+            assign_vertex_group_to_all_points(context, gp_duplicate, mouth_name + " Shape Bone")
+            self.report({'INFO'}, "Vertices added to mouth controller vertex group.")
+
+            # Scale the duplicate
+            # Gonna need to do this later
+            #gp_duplicate.scale *= 2.5
+            #bpy.ops.object.transform_apply(location=False, rotation=False, scale=True)
+
             # Create a text object for the mouth shape name
             bpy.ops.object.text_add(enter_editmode=False, location=(gp_duplicate.location.x, gp_duplicate.location.y, gp_duplicate.location.z - 0.2))
             text_obj = context.active_object
@@ -957,25 +1585,18 @@ class FinishMouthShape(bpy.types.Operator):
             else:
                 text_obj.scale = (.06, .06, .06)
             
-            # Link the text object & Duplicate to the new collection -- 
-            if gp_duplicate.name not in new_collection.objects:
-                new_collection.objects.link(gp_duplicate)
+            # Link the text object to the new collection -- 
             if text_obj.name not in new_collection.objects:
                 new_collection.objects.link(text_obj)
             
-            for col in gp_duplicate.users_collection:
-                if col != new_collection:
-                    col.objects.unlink(gp_duplicate)
             for col in text_obj.users_collection:
                 if col != new_collection:
                     col.objects.unlink(text_obj)
                     
                     
-            # Parent the text object to the duplicated GP object
-            text_obj.select_set(True)
-            gp_duplicate.select_set(True)
-            context.view_layer.objects.active = gp_duplicate
-            bpy.ops.object.parent_set(type='OBJECT', keep_transform=True)
+            # Parent the text object to the duplicated GP object, keeping its transform
+            text_obj.parent = gp_duplicate
+            text_obj.matrix_parent_inverse = gp_duplicate.matrix_world.inverted()
             gp_duplicate.hide_viewport = True
             text_obj.hide_viewport =True
             
@@ -984,12 +1605,16 @@ class FinishMouthShape(bpy.types.Operator):
             # Increment the count
             count = context.scene.finish_mouth_count
             context.scene.finish_mouth_count += 1
+            add_shape_record(context.scene.gp_mouth_shapes, mouth_name, gp_duplicate, shape_layers, current_frame)
 
             # Return to the original Grease Pencil object
             bpy.ops.object.select_all(action='DESELECT')
             context.view_layer.objects.active = gp_obj
             gp_obj.select_set(True)
 
+            if frame_mode:
+                return self.finish_mouth_shape_frame_mode(context, gp_obj, mouth_name)
+
             # Hide all existing layers in the original GP object
             for layer in gp_obj.data.layers:
                 layer.hide = True
@@ -1011,36 +1636,25 @@ class FinishMouthShape(bpy.types.Operator):
         return {'CANCELLED'}
     
     
-    # def finish_mouth_shape_frame_mode(self, context, gp_obj, mouth_name):
-    #     settings = context.scene.grease_pencil_face_rig_settings
-    #     layer = gp_obj.data.layers.active
-    #     if not layer:
-    #         self.report({'ERROR'}, "No active layer found.")
-    #         return {'CANCELLED'}
-    #     current_frame = context.scene.frame_current
-    #     if not self.check_if_auto_keying_is_on():
-    #         bpy.context.scene.tool_settings.use_keyframe_insert_auto = True
-    #         self.report({'INFO'}, "Auto keyframing has been enabled.")
-    #     item = context.scene.mouth_frames.add()
-    #     item.frame_number = current_frame
-    #     item.mouth_name = mouth_name
-    #     self.report({'INFO'}, f"Mouth shape '{mouth_name}' recorded at frame {current_frame}.")
-    #     next_frame = current_frame + 1
-    #     context.scene.frame_current = next_frame
-        
-    #     if not layer.frames.get(next_frame):
-    #         layer.frames.new(frame_number=next_frame)
-    #         settings.mouth_shape_name = ""
-    #         context.scene.finish_mouth_count += 1
-    #         self.report({'INFO'}, f"Moved to frame {next_frame} for next mouth shape.")
-    #         return {'FINISHED'}
-    
-    
-    def check_if_auto_keying_is_on(self):
-        if not bpy.context.scene.tool_settings.use_keyframe_insert_auto:
-            self.report({'WARNING'}, "Auto keyframing is not enabled. Please enable it to use frame mode.")
-            return False
-        return True
+    def finish_mouth_shape_frame_mode(self, context, gp_obj, mouth_name):
+        """Record the shape's keyframe and move to a fresh frame for the next drawing"""
+        settings = context.scene.grease_pencil_face_rig_settings
+        layer = gp_obj.data.layers.active
+        current_frame = context.scene.frame_current
+        # Frames are created explicitly below, so the user's auto keying preference is left alone
+        self.report({'INFO'}, f"Mouth shape '{mouth_name}' recorded at frame {current_frame}.")
+
+        # Skip over frames that already hold a shape
+        next_frame = current_frame + 1
+        while any(f.frame_number == next_frame for f in layer.frames):
+            next_frame += 1
+        layer.frames.new(frame_number=next_frame)
+        context.scene.frame_current = next_frame
+
+        bpy.ops.object.mode_set(mode='PAINT_GREASE_PENCIL')
+        settings.mouth_shape_name = ""
+        self.report({'INFO'}, f"Moved to frame {next_frame} for next mouth shape.")
+        return {'FINISHED'}
 
 
 
@@ -1061,47 +1675,33 @@ class GPDoneDrawingMouth(bpy.types.Operator):
         settings = context.scene.grease_pencil_face_rig_settings
         
         
-        #if context.scene.mouth_frames != None and len(context.scene.mouth_frames) > 0:
-            
+        frame_mode = settings.shape_switch_mode == 'FRAMES' and len(context.scene.gp_mouth_shapes) > 0
+
         # Ensure there are no name conflicts
         self.remove_object_by_name("Mouth Shape Control Selector")
         context.active_object.select_set(True)
         gp_obj = context.active_object
         
         if gp_obj and gp_obj.type == 'GREASEPENCIL':
-            # Create or get the vertex group
-            vgroup_name = "GP Mouth Bone"
-            if vgroup_name not in gp_obj.vertex_groups:
-                gp_obj.vertex_groups.new(name=vgroup_name)
-
-            # if settings.use_framemode:
-            #     return {'FINISHED'}
-            # Enter edit mode
-            bpy.ops.object.mode_set(mode='EDIT')
+            if frame_mode:
+                # Drop the empty keyframe that was waiting for the next shape
+                recorded = {record.frame_number for record in context.scene.gp_mouth_shapes}
+                for layer in gp_obj.data.layers:
+                    empty_frames = [frame.frame_number for frame in layer.frames
+                                    if frame.frame_number not in recorded and not len(frame.drawing.strokes)]
+                    for frame_number in empty_frames:
+                        layer.frames.remove(frame_number)
+                context.scene.frame_current = 1
+            bpy.ops.object.mode_set(mode='OBJECT')
 
             # Reveal all existing layers in the original GP object
-            for layer in gp_obj.data.layers:
+            for layer in list(gp_obj.data.layers):
                 layer.hide = False
                 if (layer.name == "New Mouth Layer"):
                     gp_obj.data.layers.remove(layer)
 
-
-            # Select all strokes
-            bpy.ops.grease_pencil.select_all(action='SELECT')
-
-            # Assign selected vertices to the vertex group
-            #Old will need updating
-            for area in bpy.context.screen.areas:
-                if area.type == 'VIEW_3D':
-                    for region in area.regions:
-                        if region.type == 'WINDOW':
-                            with bpy.context.temp_override(
-                                    area = area,
-                                    region = region,
-                                    edit_object = bpy.context.edit_object
-                            ):
-                                bpy.ops.object.vertex_group_assign()
-                            break
+            # Every shape keyframe is assigned, not only the one under the playhead
+            assign_vertex_group_to_all_points(context, gp_obj, "GP Mouth Bone")
         bpy.ops.object.mode_set(mode='OBJECT')
         self.report({'INFO'}, "Vertices added to mouth controller vertex group.")
 
@@ -1109,111 +1709,62 @@ class GPDoneDrawingMouth(bpy.types.Operator):
         collection_name = "Mouth Rig Control Board Objects"
         collection = bpy.data.collections.get(collection_name)
 
-        board_scale = 0.5
-        
         if collection is not None:
-            spacing_x = 0.25 
-            spacing_z = 0.25 
-            items_per_row = 4
-            x = 1.05 
-            z = .4 
+            ensure_shape_records(context.scene, collection, gp_obj)
+            records_by_object = {record.gp_object.name: record for record in context.scene.gp_mouth_shapes if record.gp_object}
+
+            shapes = [obj for obj in collection.objects if obj.type == 'GREASEPENCIL']
+            layout = layout_shape_board([drawing_bounds(obj) for obj in shapes], settings.board_columns, settings.board_padding)
+            (x, z), (spacing_x, spacing_z) = layout["slot_origin"], layout["slot_spacing"]
+            items_per_row = layout["columns"]
 
-            gp_object_count = 0
             for obj in collection.objects:
                 obj.hide_viewport = False
-                if obj.type == 'GREASEPENCIL':
-                    # make sure the object is visible and selectable
-                    
-                    obj.hide_viewport = False
-                    obj.hide_set(False)
-                    for layer in obj.data.layers:
-                        layer.opacity = 1.0
-                    obj.location.x = x
-                    obj.location.z = z
-                    gp_object_count += 1
-                    x += spacing_x
-
-                    if (gp_object_count % items_per_row == 0):
-                        x = 1.05
-                        z -= spacing_z
-                        obj.scale *= 2.5 * board_scale
-                elif obj.type == 'FONT':
-                    obj.location.z = obj.location.z + 0.1 
-
-            num_rows = math.ceil(gp_object_count / items_per_row)
-            bpy.ops.mesh.primitive_plane_add(size=1, enter_editmode=True, location=(2 , 0, 2), rotation=(1.5708, 0, 0))
-            plane = context.active_object
-            plane.name = "Mouth Shapes Control Plane"
-
-            plane.scale = (2 * board_scale, num_rows * 0.5 * board_scale, num_rows / 1.9 * board_scale)
-            # Change origin to the leftmost top vertex
-            plane_mesh = plane.data
-            bmesh_plane = bmesh.from_edit_mesh(plane_mesh)
-
-            # Ensure lookup table is up-to-date
-            bmesh_plane.verts.ensure_lookup_table()
-
-            # Deselect all vertices first
-            for v in bmesh_plane.verts:
-                v.select = False
-
-            # Select only the top left vertex (index 2 for a rotated plane)
-            bmesh_plane.verts[2].select = True
-
-            # Ensure the selection mode is set to vertex
-            bpy.ops.mesh.select_mode(type='VERT')
-
-            # Update the BMesh and the mesh in Blender
-            bmesh.update_edit_mesh(plane_mesh)
-
-            # Create an override context for the VIEW_3D area and region
-            
-            for area in bpy.context.screen.areas:
-                    if area.type == 'VIEW_3D':
-                        for region in area.regions:
-                            if region.type == 'WINDOW':
-                                # Using temp_override for cleaner context override
-                                with bpy.context.temp_override(
-                                        area=area,
-                                        region=region,
-                                        edit_object = plane
-                                ):
-                                    bpy.ops.view3d.snap_cursor_to_selected()
-                                break
-                            else:
-                                continue
-                            break
-
-            # Return to object mode and set the origin to the cursor
-            bpy.ops.object.mode_set(mode='OBJECT')
-            bpy.ops.object.origin_set(type='ORIGIN_CURSOR')
-            bpy.context.scene.cursor.location = (0, 0, 0)  # Reset the cursor location
-
-            plane.location.x = .9 
-            plane.location.z = .5
-            
-             
+                if obj.type == 'FONT':
+                    # Labels are parented to their shape
+                    obj.location.z = layout["label_offset"]
+            for slot, obj in enumerate(shapes):
+                # make sure the object is visible and selectable
+                obj.hide_set(False)
+                for layer in obj.data.layers:
+                    layer.opacity = 1.0
+                row, column = divmod(slot, items_per_row)
+                obj.location.x = x + column * spacing_x
+                obj.location.z = z - row * spacing_z
+                if obj.name in records_by_object:
+                    records_by_object[obj.name].board_slot = slot
+            if settings.merge_shape_labels:
+                merge_shape_labels(collection)
+            # Every board copy is visible again and the preview is over
+            reset_onion_state()
+            remove_onion_overlay()
+
+            # Build the plane with its final vertices, origin on the top left corner. No edit mode, cursor or
+            # origin/transform operators, so it also works headless
+            width, height = layout["size"]
+            plane_mesh = bpy.data.meshes.new("Mouth Shapes Control Plane")
+            plane_mesh.from_pydata([(0, -height, 0), (width, -height, 0), (0, 0, 0), (width, 0, 0)], [], [(0, 1, 3, 2)])
+            plane_mesh.update()
+            plane = bpy.data.objects.new("Mouth Shapes Control Plane", plane_mesh)
+            plane.rotation_euler = (math.pi / 2, 0, 0)
+            plane.location.x, plane.location.z = layout["top_left"]
+            # Record the slot grid so the rig builder can map board positions to shape indices
+            plane["slot_origin"] = (x, z)
+            plane["slot_spacing"] = (spacing_x, spacing_z)
+            plane["board_columns"] = items_per_row
 
             # Make the plane unselectable and change its display type to wire
             plane.display_type = 'WIRE'
             # plane.hide_select = True
             plane.hide_render = True
-            
-             # Apply the scale transformation
-            bpy.ops.object.mode_set(mode='OBJECT')  # Ensure we are in object mode
-            bpy.context.view_layer.objects.active = plane
-            bpy.ops.object.transform_apply(location=False, scale=True, rotation=False)
-           
 
             # Add the plane to the "Mouth Rig Control Board Objects" collection
             collection.objects.link(plane)
-            context.collection.objects.unlink(plane)
-            
-            # Create a puck (mesh circle) and place it on top of the first duplicated object
-            first_dup_obj = collection.objects[0] if collection.objects else None
-            if first_dup_obj:
-                bpy.ops.mesh.primitive_circle_add(fill_type='NGON', vertices=16, radius=0.035, location=(
-                first_dup_obj.location.x, first_dup_obj.location.y, first_dup_obj.location.z), rotation=(1.5708, 0, 0))
+
+            # Create a puck (mesh circle) sized to the slots and place it on the first one
+            if shapes:
+                bpy.ops.mesh.primitive_circle_add(fill_type='NGON', vertices=16, radius=0.14 * min(spacing_x, spacing_z),
+                                                  location=(x, shapes[0].location.y, z), rotation=(1.5708, 0, 0))
                 puck = context.active_object
                 puck.name = "Mouth Shape Control Selector"
                 bpy.ops.object.mode_set(mode='OBJECT')
@@ -1283,7 +1834,7 @@ class GPDoneDrawingMouth(bpy.types.Operator):
             
 
             self.report({'INFO'},
-                        f"Arranged {len(collection.objects)} objects in {(len(collection.objects) + items_per_row - 1) // items_per_row} rows.")
+                        f"Arranged {len(shapes)} shapes in {layout['rows']} rows of {items_per_row}.")
         else:
             self.report({'ERROR'}, f"Collection '{collection_name}' not found.")
 
@@ -1385,49 +1936,131 @@ def get_lattice_index(u, v, w, res_u=6, res_v=2, res_w=6):
     return u + (v * res_u) + (w * res_u * res_v)
 
 
-def create_bone_shape(name, shape_type='CIRCLE', scale=(0.1, 0.1, .1), rotation=(0, 0, 0), delete_faces=True, label=""):
-    #Bone Head will be at the CENTER of the mesh - so the center of shapes should be at bottom of the mesh or the bone head should be offset.
-    # Create a new mesh object to use as the bone shape
-    if shape_type == 'CIRCLE':
-        bpy.ops.mesh.primitive_circle_add(vertices=32, radius=0.5)
-    elif shape_type == 'SQUARE':
-        bpy.ops.mesh.primitive_plane_add(size=1)
-    elif shape_type == 'ARROW':
-        bpy.ops.mesh.primitive_cone_add(vertices=4, radius1=0.3, depth=0.6)
-        bpy.context.active_object.rotation_euler = (0, 0, 0)
-        bpy.ops.object.transform_apply(rotation=True)
-    elif shape_type == 'TEXT':
-        bpy.ops.object.text_add()
-        text_obj = bpy.context.active_object
-        if label != "" or label is not None:
-            text_obj.data.body = label
-            text_obj.data.size = 0.1
-            text_obj.data.align_x = 'CENTER'
-            text_obj.name = f"{label}"
-            text_obj.rotation_euler = (1.5707, 0, 0)
-            bpy.ops.object.convert(target='MESH')
-            bpy.ops.object.mode_set(mode='EDIT')
-            bpy.ops.mesh.select_all(action='SELECT')
-            bpy.ops.mesh.dissolve_limited(angle_limit=0.05)
-            bpy.ops.object.mode_set(mode='OBJECT')
-
-            
+#Widget library: bone shape meshes built straight from vertex data
+def _circle_points(count, radius, z=0.0):
+    return [(-math.sin(2 * math.pi * i / count) * radius, math.cos(2 * math.pi * i / count) * radius, z)
+            for i in range(count)]
+
+def _loop_edges(count, start=0):
+    return [(start + i, start + (i + 1) % count) for i in range(count)]
+
+# shape type -> (vertices, outline edges, faces), matching the mesh primitives the shapes used to be made from
+WIDGET_SHAPES = {
+    # primitive_circle_add(vertices=32, radius=0.5)
+    'CIRCLE': (_circle_points(32, 0.5), _loop_edges(32), []),
+    # primitive_plane_add(size=1)
+    'SQUARE': ([(-0.5, -0.5, 0), (0.5, -0.5, 0), (-0.5, 0.5, 0), (0.5, 0.5, 0)],
+               [(0, 1), (1, 3), (3, 2), (2, 0)],
+               [(0, 1, 3, 2)]),
+    # primitive_cone_add(vertices=4, radius1=0.3, depth=0.6)
+    'ARROW': (_circle_points(4, 0.3, -0.3) + [(0, 0, 0.3)],
+              _loop_edges(4) + [(i, 4) for i in range(4)],
+              [(3, 2, 1, 0)] + [(i, (i + 1) % 4, 4) for i in range(4)]),
+}
 
-    shape_obj = bpy.context.active_object
-    shape_obj.name = name
+_widget_mesh_cache = {}
+_label_mesh_cache = {}
+
+def _cached_mesh(cache, key):
+    # The key is also stored on the mesh, so the cache survives reloading the add-on or the file
+    key_string = repr(key)
+    mesh = bpy.data.meshes.get(cache.get(key, ""))
+    if mesh is None or mesh.get("gp_face_widget") != key_string:
+        mesh = next((m for m in bpy.data.meshes if m.get("gp_face_widget") == key_string), None)
+    if mesh is not None:
+        cache[key] = mesh.name
+    return mesh
+
+def _store_cached_mesh(cache, key, mesh):
+    mesh["gp_face_widget"] = repr(key)
+    cache[key] = mesh.name
+
+def get_widget_mesh(shape_type, scale=(0.1, 0.1, 0.1), rotation=(0, 0, 0), delete_faces=True):
+    """Shared widget mesh for a shape type, scale and rotation.
+    Identical widgets on every rig in the file use the same mesh datablock."""
+    key = (shape_type, tuple(round(v, 5) for v in scale), tuple(round(v, 5) for v in rotation), bool(delete_faces))
+    mesh = _cached_mesh(_widget_mesh_cache, key)
+    if mesh is None:
+        vertices, edges, faces = WIDGET_SHAPES[shape_type]
+        transform = Euler(rotation).to_matrix()
+        vertices = [transform @ Vector((x * scale[0], y * scale[1], z * scale[2])) for x, y, z in vertices]
+        mesh = bpy.data.meshes.new(f"WGT_{shape_type.title()}")
+        if delete_faces:
+            mesh.from_pydata(vertices, edges, [])
+        else:
+            mesh.from_pydata(vertices, [], faces)
+        mesh.update()
+        _store_cached_mesh(_widget_mesh_cache, key, mesh)
+    return mesh
+
+def get_label_mesh(text, size=0.1, scale=(1, 1, 1), rotation=(0, 0, 0), delete_faces=False, align_y='TOP_BASELINE'):
+    """Shared mesh of a text label. Each string is converted from a font only once per size and transform."""
+    key = ('TEXT', text, round(size, 5), tuple(round(v, 5) for v in scale), tuple(round(v, 5) for v in rotation),
+           bool(delete_faces), align_y)
+    mesh = _cached_mesh(_label_mesh_cache, key)
+    if mesh is not None:
+        return mesh
+
+    # Evaluate a throwaway font object instead of converting a live one with operators
+    curve = bpy.data.curves.new("GP Face Label", 'FONT')
+    curve.body = text
+    curve.size = size
+    curve.align_x = 'CENTER'
+    curve.align_y = align_y
+    font_obj = bpy.data.objects.new("GP Face Label", curve)
+    bpy.context.scene.collection.objects.link(font_obj)
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    mesh = bpy.data.meshes.new_from_object(font_obj.evaluated_get(depsgraph))
+    bpy.data.objects.remove(font_obj, do_unlink=True)
+    bpy.data.curves.remove(curve)
 
-    # Apply transformations
-    shape_obj.scale = scale
-    
-    shape_obj.rotation_euler = rotation
-    bpy.ops.object.transform_apply(scale=True, rotation=True, location=False)
-    #Delete only faces
+    bm = bmesh.new()
+    bm.from_mesh(mesh)
+    bmesh.ops.dissolve_limited(bm, angle_limit=0.05, verts=bm.verts[:], edges=bm.edges[:])
     if delete_faces:
-        bpy.ops.object.mode_set(mode='EDIT')
-        bpy.ops.mesh.select_all(action='SELECT')
-        bpy.ops.mesh.delete(type='ONLY_FACE')
-        bpy.ops.object.mode_set(mode='OBJECT')
-    
+        bmesh.ops.delete(bm, geom=bm.faces[:], context='FACES_ONLY')
+    bm.transform(Euler(rotation).to_matrix().to_4x4() @ Matrix.Diagonal((*scale, 1.0)))
+    bm.to_mesh(mesh)
+    bm.free()
+    mesh.name = f"LBL_{text}"
+    _store_cached_mesh(_label_mesh_cache, key, mesh)
+    return mesh
+
+def merge_shape_labels(collection, name="Mouth Shape Labels"):
+    """Bake the per-shape text labels of the control board into one mesh object, so the depsgraph
+    stops evaluating a font object for every shape"""
+    labels = [obj for obj in collection.objects if obj.type == 'FONT']
+    if not labels:
+        return None
+    bpy.context.view_layer.update()
+
+    vertex_chunks = []
+    faces = []
+    offset = 0
+    for label in labels:
+        mesh = get_label_mesh(label.data.body, label.data.size, align_y=label.data.align_y)
+        co = np.empty(len(mesh.vertices) * 3, dtype=np.float64)
+        mesh.vertices.foreach_get("co", co)
+        matrix = np.array(label.matrix_world)
+        co = co.reshape(-1, 3) @ matrix[:3, :3].T + matrix[:3, 3]
+        vertex_chunks.append(co)
+        faces.extend(tuple(i + offset for i in polygon.vertices) for polygon in mesh.polygons)
+        offset += len(co)
+
+    merged = bpy.data.meshes.new(name)
+    merged.from_pydata(np.concatenate(vertex_chunks).tolist(), [], faces)
+    merged.update()
+    merged_obj = bpy.data.objects.new(name, merged)
+    collection.objects.link(merged_obj)
+
+    for label in labels:
+        curve = label.data
+        bpy.data.objects.remove(label, do_unlink=True)
+        if not curve.users:
+            bpy.data.curves.remove(curve)
+    return merged_obj
+
+def link_to_bone_shapes(shape_obj):
     # Move to a hidden collection so it doesnt clutter the scene
     shape_collection = bpy.data.collections.get("BoneShapes")
     if not shape_collection:
@@ -1438,7 +2071,16 @@ def create_bone_shape(name, shape_type='CIRCLE', scale=(0.1, 0.1, .1), rotation=
     for col in shape_obj.users_collection:
         col.objects.unlink(shape_obj)
     shape_collection.objects.link(shape_obj)
-    
+
+def create_bone_shape(name, shape_type='CIRCLE', scale=(0.1, 0.1, .1), rotation=(0, 0, 0), delete_faces=True, label=""):
+    #Bone Head will be at the CENTER of the mesh - so the center of shapes should be at bottom of the mesh or the bone head should be offset.
+    # Identical widgets and labels share one mesh, keyed by shape and transform
+    if shape_type == 'TEXT':
+        mesh = get_label_mesh(label or name, 0.1, scale, rotation, delete_faces)
+    else:
+        mesh = get_widget_mesh(shape_type, scale, rotation, delete_faces)
+    shape_obj = bpy.data.objects.new(name, mesh)
+    link_to_bone_shapes(shape_obj)
     return shape_obj
 
 
@@ -1453,14 +2095,13 @@ def setup_control_board_shapes(armature):
     
     layer_collection = bpy.context.scene.view_layers[0].layer_collection
     temp_layer = layer_collection.children.get("Temp Drawing Collection")
+    bone_shapes_layer = None
     if temp_layer:
         bone_shapes_layer = temp_layer.children.get("BoneShapes")
     if bone_shapes_layer:
         bone_shapes_layer.exclude = True
-        
-    
-    bpy.context.view_layer.objects.active = armature
-    bpy.ops.object.mode_set(mode='POSE')
+
+    # Custom shapes and colors are plain pose bone data, no need to enter pose mode for them
 
     # Define bones and their shapes/labels
     control_bones = {
@@ -1566,54 +2207,569 @@ def setup_control_board_shapes(armature):
         # Set bone color group
         pose_bone.color.palette = 'CUSTOM'
         pose_bone.color.custom.normal = settings["color"][:3]
- 
 
-    
 
+def _node_socket(sockets, identifier):
+    return next(socket for socket in sockets if socket.identifier == identifier)
+
+def ensure_shape_switcher_node_group():
+    """Geometry Nodes group keeping only the Grease Pencil layers whose "shape_index" matches the input.
+    Shared by every rig in the file."""
+    node_group = bpy.data.node_groups.get("GP Face Shape Switcher")
+    if node_group:
+        return node_group
+    node_group = bpy.data.node_groups.new("GP Face Shape Switcher", 'GeometryNodeTree')
+    node_group.is_modifier = True
+    node_group.interface.new_socket("Geometry", in_out='INPUT', socket_type='NodeSocketGeometry')
+    node_group.interface.new_socket("Shape Index", in_out='INPUT', socket_type='NodeSocketInt')
+    node_group.interface.new_socket("Geometry", in_out='OUTPUT', socket_type='NodeSocketGeometry')
+
+    nodes = node_group.nodes
+    links = node_group.links
+    group_input = nodes.new('NodeGroupInput')
+    group_input.location = (-600, 0)
+    group_output = nodes.new('NodeGroupOutput')
+    group_output.location = (400, 0)
+
+    shape_index = nodes.new('GeometryNodeInputNamedAttribute')
+    shape_index.location = (-600, -200)
+    shape_index.data_type = 'INT'
+    shape_index.inputs["Name"].default_value = "shape_index"
+
+    # Layers tagged -1 are not mouth shapes and are always kept
+    is_shape = nodes.new('FunctionNodeCompare')
+    is_shape.location = (-350, -300)
+    is_shape.data_type = 'INT'
+    is_shape.operation = 'GREATER_EQUAL'
+    _node_socket(is_shape.inputs, "B_INT").default_value = 0
+
+    is_inactive = nodes.new('FunctionNodeCompare')
+    is_inactive.location = (-350, -100)
+    is_inactive.data_type = 'INT'
+    is_inactive.operation = 'NOT_EQUAL'
+
+    both = nodes.new('FunctionNodeBooleanMath')
+    both.location = (-150, -200)
+    both.operation = 'AND'
+
+    delete = nodes.new('GeometryNodeDeleteGeometry')
+    delete.location = (100, 0)
+    delete.domain = 'LAYER'
+
+    links.new(shape_index.outputs["Attribute"], _node_socket(is_shape.inputs, "A_INT"))
+    links.new(shape_index.outputs["Attribute"], _node_socket(is_inactive.inputs, "A_INT"))
+    links.new(group_input.outputs["Shape Index"], _node_socket(is_inactive.inputs, "B_INT"))
+    links.new(is_inactive.outputs["Result"], both.inputs[0])
+    links.new(is_shape.outputs["Result"], both.inputs[1])
+    links.new(group_input.outputs["Geometry"], delete.inputs["Geometry"])
+    links.new(both.outputs["Boolean"], delete.inputs["Selection"])
+    links.new(delete.outputs["Geometry"], group_output.inputs["Geometry"])
+    return node_group
+
+
+def child_of_rest_inverse(armature, bone_name):
+    """Child Of inverse matrix for a bone in rest pose, computed without evaluating the depsgraph"""
+    return (armature.matrix_world @ armature.data.bones[bone_name].matrix_local).inverted()
+
+def add_bone_location_variables(driver, armature, variables):
+    for var_name, bone_target, transform_type in variables:
+        var = driver.variables.new()
+        var.name = var_name
+        var.type = 'TRANSFORMS'
+        var.targets[0].id = armature
+        var.targets[0].bone_target = bone_target
+        var.targets[0].transform_type = transform_type
+        var.targets[0].transform_space = 'WORLD_SPACE'
+
+def add_shape_index_variable(driver, armature):
+    var = driver.variables.new()
+    var.name = "idx"
+    var.type = 'SINGLE_PROP'
+    var.targets[0].id = armature
+    var.targets[0].data_path = '["active_shape_index"]'
+    return var
+
+def add_distance_visibility_driver(layer, armature, bone_name):
+    """Hide the layer unless the puck sits on the shape's bone"""
+    driver = layer.driver_add("hide").driver
+    driver.type = 'SCRIPTED'
+    add_bone_location_variables(driver, armature, (
+        ("puck_x", "mouth_puck_control", 'LOC_X'),
+        ("bone_x", bone_name, 'LOC_X'),
+        ("puck_z", "mouth_puck_control", 'LOC_Z'),
+        ("bone_z", bone_name, 'LOC_Z'),
+    ))
+    driver.expression = "(abs(puck_x - bone_x) > 0.1) or (abs(puck_z - bone_z) > 0.1)"
+
+def add_index_visibility_driver(layer, armature, index):
+    # One single-property variable per layer instead of four transform lookups
+    driver = layer.driver_add("hide").driver
+    driver.type = 'SCRIPTED'
+    add_shape_index_variable(driver, armature)
+    driver.expression = f"idx != {index}"
+
+def write_layer_shape_indices(gp_obj, layer_indices):
+    """Set the "shape_index" layer attribute read by the switcher node group for the layers in layer_indices.
+    Other layers keep their value, -1 (always shown) when the attribute is new."""
+    layers = gp_obj.data.layers
+    values = np.full(len(layers), -1, dtype=np.int32)
+    attribute = gp_obj.data.attributes.get("shape_index")
+    if attribute is None:
+        attribute = gp_obj.data.attributes.new("shape_index", 'INT', 'LAYER')
+    else:
+        attribute.data.foreach_get("value", values)
+    for index, layer in enumerate(layers):
+        if layer.name in layer_indices:
+            values[index] = layer_indices[layer.name]
+    attribute.data.foreach_set("value", values)
+
+
+class MouthRigBuilder:
+    """Builds the mouth rig through the data API.
+
+    Every edit bone is created in one edit session, then constraints, drivers and modifiers are
+    added in object mode without operators or a VIEW_3D area, so it also runs in `blender -b`.
+    """
+
+    # Direct lattice control bones, parented to the GP Mouth Bone
+    lattice_bone_positions = {
+        "Mouth_Top_L":     ((.08, 0, .02), (.08, 0, 0.04)),
+        "Mouth_Top_C":     ((0, 0, .02),    (0, 0, 0.04)),
+        "Mouth_Top_R":     ((-.08, 0, .02),  (-.08, 0, 0.04)),
+        "Mouth_Bot_L":     ((.08, 0, -.04), (.08, 0, -0.02)),
+        "Mouth_Bot_C":     ((0, 0, -.04),    (0, 0, -0.02)),
+        "Mouth_Bot_R":     ((-.08, 0, -.04),  (-.08, 0, -0.02)),
+        #"Mouth_Depth":     ((0, 0, -0.3), (0, 0, 0.4)), -
+    }
 
-# Might have to break these into separate classes for each element
-class CreateRig(bpy.types.Operator):
-    """Create the face rig based on the drawn mouth shapes and control board"""
-    bl_idname = "object.create_rig"
-    bl_label = "Create Rig"
-    bl_options = {'REGISTER', 'UNDO'}
-    
-    
-    # Set up 
-    # | GP Face Rig Root
-    #   |--> GP Mouth Bone/ labels/ canvas / Hooks (parented to root, has vertex group for mouth shapes)
-    #     |---> GP Object 
-    #     |---> Lattice via Constraints (Child of rig, AND constrained to GP Mouth Bone (Also has hook modifiers using vertex groups)
-    #     
-   
-   
-    rig_name: bpy.props.StringProperty(name="Rig Name", default="Character")
-    
-    def invoke(self, context, event):
-        return context.window_manager.invoke_props_dialog(self)
-    
-    bone_definitions={
-        "GP Face Rig Root": {
-            "head": (0, .2, 0),
-            "tail": (0, .2, .25),
-            "deform": True,
-        },
-        "GP Mouth Bone": { # This is causing weird transforms when rotated - think I solved it by changing the bone head to 0,0,0
-            "head": (0, 0, 0),
-            "tail": (0, 0, .025),
-            "deform": True,
-        },
-        "shape_board": {
-            "head": (0, 0, 0),
-            "tail": (0, 0, 0.2),
-            "deform": False,
-        },
-        "Face_Main_Control_Board": {
-            "head": (.5,    0, .1),
-            "tail": (.5, 0, .3),
-            "deform": False,
-        },
-        "Label_Face_Main_Control_Board": {
+    # Defaults matching the GPDoneDrawingMouth grid, used when the control plane has no layout recorded
+    default_slot_origin = (1.05, .4)
+    default_slot_spacing = (.25, .25)
+    default_board_columns = 4
+
+    def __init__(self, context, gp_obj, collection, rig_id, bone_definitions, mode='DISTANCE'):
+        self.context = context
+        self.mode = mode
+        self.gp_obj = gp_obj
+        self.collection = collection
+        self.rig_id = rig_id
+        self.bone_definitions = bone_definitions
+        self.armature = None
+        self.shape_board = None
+        self.puck = None
+        self.shape_labels = None
+        self.lattice = bpy.data.objects.get("GPMouthLattice")
+        ensure_shape_records(context.scene, collection, gp_obj)
+        self.shape_records = [record for record in context.scene.gp_mouth_shapes
+                              if record.gp_object and record.gp_object.name in collection.objects]
+        self.shape_objects = [record.gp_object for record in self.shape_records]
+
+    def find_board_objects(self):
+        for obj in self.collection.objects:
+            if obj.name == "Mouth Shapes Control Plane":
+                self.shape_board = obj
+            elif obj.name == "Mouth Shape Control Selector":
+                self.puck = obj
+            elif obj.name == "Mouth Shape Labels":
+                self.shape_labels = obj
+        return self.shape_board is not None and self.puck is not None
+
+    def build(self):
+        self.create_armature()
+        self.build_edit_bones()
+        self.build_object_constraints()
+        self.build_pose_bones()
+        self.build_gp_modifiers()
+        self.store_board_layout()
+        if self.mode == 'INDEX':
+            self.build_shape_index_driver()
+            self.build_index_visibility_drivers()
+        elif self.mode == 'FRAMES':
+            self.build_shape_index_driver()
+            self.build_time_offset_switcher()
+        elif self.mode == 'GEONODES':
+            self.build_shape_index_driver()
+            self.build_geometry_nodes_switcher()
+        else:
+            self.build_layer_visibility_drivers()
+        self.build_lattice_hooks()
+        self.build_thickness_driver()
+        setup_control_board_shapes(self.armature)
+        return self.armature
+
+    def create_armature(self):
+        context = self.context
+        if context.mode != 'OBJECT':
+            bpy.ops.object.mode_set(mode='OBJECT')
+        for obj in context.selected_objects:
+            obj.select_set(False)
+
+        # Add the armature to the same collection as the Grease Pencil object
+        arm_data = bpy.data.armatures.new("GP_Rig")
+        armature = bpy.data.objects.new("GP_Rig", arm_data)
+        self.gp_obj.users_collection[0].objects.link(armature)
+        tag_rig_object(armature, self.rig_id, "Main Armature")
+        self.armature = armature
+
+        #Create bone collections
+        self.face_coll = arm_data.collections.new("Face")
+        self.mouth_coll = arm_data.collections.new("Mouth Bones", parent=self.face_coll)
+        arm_data.collections.new("Eyes Bones", parent=self.face_coll)
+        arm_data.collections.new("Nose Bones", parent=self.face_coll)
+        hid_coll = arm_data.collections.new("Hidden Bones", parent=self.face_coll)
+        hid_coll.is_visible = False
+        self.hid_mouth_coll = arm_data.collections.new("Hidden Mouth Bones", parent=hid_coll)
+        arm_data.collections.new("Hidden Eyes Bones", parent=hid_coll)
+        arm_data.collections.new("Hidden Eyebrow Bones", parent=hid_coll)
+        arm_data.collections.new("Hidden Nose Bones", parent=hid_coll)
+
+    def new_edit_bone(self, name, head, tail, parent=None, collection=None):
+        bone = self.armature.data.edit_bones.new(name)
+        bone.head = head
+        bone.tail = tail
+        bone.parent = parent
+        bone.use_connect = False
+        if collection:
+            collection.assign(bone)
+        return bone
+
+    def build_edit_bones(self):
+        """Create every bone of the rig in a single edit mode session"""
+        self.context.view_layer.objects.active = self.armature
+        bpy.ops.object.mode_set(mode='EDIT')
+        defs = self.bone_definitions
+
+        # Create the root bone, it's slightly offset
+        # from the mouth to be in the center of the head it'll join with
+        root_bone = self.new_edit_bone("GP Face Rig Root", defs["GP Face Rig Root"]["head"], defs["GP Face Rig Root"]["tail"],
+                                       collection=self.face_coll)
+        # Create the named bone and place it in middle of Lattice
+        mouth_bone = self.new_edit_bone("GP Mouth Bone", defs["GP Mouth Bone"]["head"], defs["GP Mouth Bone"]["tail"],
+                                        root_bone, self.hid_mouth_coll)
+
+        # Create the control board bone
+        board = self.shape_board
+        shape_board_bone = self.new_edit_bone("shape_board_bone", board.location,
+                                              (board.location.x, board.location.y, board.location.z + board.scale.z),
+                                              root_bone, self.mouth_coll)
+        shape_board_bone.use_deform = False
+        shape_board_bone.show_wire = True
+
+        # Create the puck control bone
+        puck = self.puck
+        self.new_edit_bone("mouth_puck_control", puck.location, (puck.location.x, puck.location.y, puck.location.z + 0.2),
+                           shape_board_bone, self.mouth_coll)
+
+        #Create Bones for each GP object in the other collection and set them to hide
+        for record in self.shape_records:
+            obj = record.gp_object
+            bone = self.new_edit_bone(f"{obj.name}_Shape_Bone", obj.location, (obj.location.x, obj.location.y, obj.location.z + 0.2),
+                                      shape_board_bone, self.hid_mouth_coll)
+            record.bone_name = bone.name
+
+        # Create bones for lattice - hooked to the lattice vertex groups later
+        if self.lattice:
+            for bone_name, (head, tail) in self.lattice_bone_positions.items():
+                self.new_edit_bone(bone_name, head, tail, mouth_bone, self.hid_mouth_coll)
+
+        ##### Create Mouth Face Rig Control Panel #####
+        #Main control Board
+        main_control_bone = self.new_edit_bone("Face_Main_Control_Board", defs["Face_Main_Control_Board"]["head"],
+                                               defs["Face_Main_Control_Board"]["tail"], root_bone, self.mouth_coll)
+        #Main Control Board Label
+        self.new_edit_bone("Label_Face_Main_Control_Board", defs["Label_Face_Main_Control_Board"]["head"],
+                           defs["Label_Face_Main_Control_Board"]["tail"], main_control_bone, self.mouth_coll)
+        #Canvas bone
+        canvas_bone = self.new_edit_bone("Face_Mouth_Canvas", defs["Face_Mouth_Canvas"]["head"],
+                                         defs["Face_Mouth_Canvas"]["tail"], main_control_bone, self.mouth_coll)
+        #Mouth position controller
+        position_bone = self.new_edit_bone("Face_Mouth_Position_Control", defs["Face_Mouth_Position_Control"]["head"],
+                                           defs["Face_Mouth_Position_Control"]["tail"], canvas_bone, self.mouth_coll)
+        #Mouth Position Label Bone
+        self.new_edit_bone("Label_Mouth_Position_Control", defs["Label_Mouth_Position_Control"]["head"],
+                           defs["Label_Mouth_Position_Control"]["tail"], canvas_bone, self.mouth_coll)
+
+        # Hook controls - relative positions added to the Face_Mouth_Position_Control bone's head and tail
+        for bone_name in self.lattice_bone_positions:
+            hook_control_bone_name = bone_name.replace("Mouth_", "Hook_Mouth_")
+            head = Vector(defs[hook_control_bone_name]["head"]) + Vector(defs["Face_Mouth_Position_Control"]["head"])
+            tail = Vector(defs[hook_control_bone_name]["tail"]) + Vector(defs["Face_Mouth_Position_Control"]["tail"])
+            self.new_edit_bone(hook_control_bone_name, head, tail, position_bone, self.mouth_coll)
+
+        bpy.ops.object.mode_set(mode='OBJECT')
+
+    def add_child_of(self, obj, bone_name):
+        constraint = obj.constraints.new('CHILD_OF')
+        constraint.target = self.armature
+        constraint.subtarget = bone_name
+        # The new rig is still in rest pose, so the inverse is the bone's rest matrix - no operator or depsgraph update
+        constraint.inverse_matrix = child_of_rest_inverse(self.armature, bone_name)
+        return constraint
+
+    def build_object_constraints(self):
+        for record in self.shape_records:
+            self.add_child_of(record.gp_object, record.bone_name)
+        self.add_child_of(self.shape_board, "shape_board_bone")
+        if self.shape_labels:
+            self.add_child_of(self.shape_labels, "shape_board_bone")
+            tag_rig_object(self.shape_labels, self.rig_id, "Shape Labels")
+        self.shape_board.hide_viewport = True
+        self.puck.hide_viewport = True
+
+        # Ensure the puck follows its control bone
+        childof_puck = self.puck.constraints.new('CHILD_OF')
+        childof_puck.target = self.armature
+        childof_puck.subtarget = "mouth_puck_control"
+
+    def build_pose_bones(self):
+        armature = self.armature
+        pose_bones = armature.pose.bones
+
+        shape_board_bone_obj = pose_bones["shape_board_bone"]
+        shape_board_bone_obj.custom_shape = self.shape_board
+        shape_board_bone_obj.use_custom_shape_bone_size = False
+
+        mouth_puck_control_bone_obj = pose_bones["mouth_puck_control"]
+        mouth_puck_control_bone_obj.custom_shape = self.puck
+        mouth_puck_control_bone_obj.use_custom_shape_bone_size = False
+        mouth_puck_control_bone_obj.bone.hide = False
+
+        # Add shrinkwrap constraint to the puck bone
+        shrinkwrap = mouth_puck_control_bone_obj.constraints.new('SHRINKWRAP')
+        shrinkwrap.target = self.shape_board
+        shrinkwrap.wrap_mode = 'ON_SURFACE'
+
+        copy_transform = pose_bones["GP Mouth Bone"].constraints.new('COPY_TRANSFORMS')
+        copy_transform.target = armature
+        copy_transform.subtarget = "Face_Mouth_Position_Control"
+        copy_transform.mix_mode = 'AFTER_SPLIT'
+        copy_transform.target_space = 'LOCAL_OWNER_ORIENT'
+        copy_transform.owner_space = 'LOCAL'
+
+        # Add a copy transforms constraint to the helper controls for each of the lattice bones
+        for bone_name in self.lattice_bone_positions:
+            pose_bone = pose_bones.get(bone_name)
+            if not pose_bone:
+                continue
+            copy_transforms = pose_bone.constraints.new('COPY_TRANSFORMS')
+            copy_transforms.target = armature
+            copy_transforms.subtarget = bone_name.replace("Mouth_", "Hook_Mouth_")
+            copy_transforms.mix_mode = 'AFTER_SPLIT'
+            copy_transforms.target_space = 'LOCAL_OWNER_ORIENT'
+            copy_transforms.owner_space = 'LOCAL'
+
+    def build_gp_modifiers(self):
+        # Parent the GP object to the armature with weights previously defined
+        gp_obj = self.gp_obj
+        gp_obj.parent = self.armature
+        gp_obj.parent_type = 'ARMATURE'
+        arm_mod = gp_obj.modifiers.new(name="ArmatureDeform", type='GREASE_PENCIL_ARMATURE')
+        arm_mod.object = self.armature
+        arm_mod.use_vertex_groups = True
+        # Deform with the armature before the lattice
+        index = gp_obj.modifiers.find(arm_mod.name)
+        if index > 0:
+            gp_obj.modifiers.move(index, index - 1)
+
+    def shape_layers(self):
+        """Yield (layer, shape record) pairs for every layer drawn for a mouth shape"""
+        layers = {layer.name: layer for layer in self.gp_obj.data.layers}
+        for record in self.shape_records:
+            for item in record.layer_names:
+                layer = layers.get(item.name)
+                if layer is not None:
+                    yield layer, record
+
+    def build_layer_visibility_drivers(self):
+        # Set up drivers for layer visibility using bones
+        for layer, record in self.shape_layers():
+            add_distance_visibility_driver(layer, self.armature, record.bone_name)
+
+    def board_layout(self):
+        """Slot grid of the control board - origin and spacing in world X/Z, and the number of columns"""
+        board = self.shape_board
+        origin = tuple(board.get("slot_origin", self.default_slot_origin))
+        spacing = tuple(board.get("slot_spacing", self.default_slot_spacing))
+        columns = int(board.get("board_columns", self.default_board_columns))
+        return origin, spacing, columns
+
+    def shape_index(self, record):
+        """Board slot of a shape, counted left to right and top to bottom"""
+        if record.board_slot >= 0:
+            return record.board_slot
+        obj = record.gp_object
+        (origin_x, origin_z), (spacing_x, spacing_z), columns = self.board_layout()
+        column = round((obj.location.x - origin_x) / spacing_x)
+        row = round((origin_z - obj.location.z) / spacing_z)
+        return row * columns + column
+
+    def store_board_layout(self):
+        """Keep the switching mode and the slot grid on the armature, so shapes can be added to the finished rig"""
+        armature = self.armature
+        (origin_x, origin_z), spacing, columns = self.board_layout()
+        # Slot grid relative to the board bone, so it still holds once the rig is moved
+        armature["shape_switch_mode"] = self.mode
+        armature["shape_slot_origin"] = (origin_x - self.shape_board.location.x, origin_z - self.shape_board.location.z)
+        armature["shape_slot_spacing"] = spacing
+        armature["shape_board_columns"] = columns
+
+    def build_shape_index_driver(self):
+        """Turn the puck position into one integer "active_shape_index" property on the armature"""
+        armature = self.armature
+        offset_x, offset_z = armature["shape_slot_origin"]
+        spacing_x, spacing_z = armature["shape_slot_spacing"]
+        columns = armature["shape_board_columns"]
+        armature["active_shape_index"] = 0
+
+        driver = armature.driver_add('["active_shape_index"]').driver
+        driver.type = 'SCRIPTED'
+        add_bone_location_variables(driver, armature, (
+            ("puck_x", "mouth_puck_control", 'LOC_X'),
+            ("puck_z", "mouth_puck_control", 'LOC_Z'),
+            ("board_x", "shape_board_bone", 'LOC_X'),
+            ("board_z", "shape_board_bone", 'LOC_Z'),
+        ))
+        # Only builtins the simple expression evaluator knows, so it never falls back to Python
+        column = f"min(max(floor((puck_x - board_x - ({offset_x:.6g})) / {spacing_x:.6g} + 0.5), 0), {columns - 1})"
+        row = f"max(floor((({offset_z:.6g}) - (puck_z - board_z)) / {spacing_z:.6g} + 0.5), 0)"
+        driver.expression = f"{column} + {row} * {columns}"
+
+    def build_index_visibility_drivers(self):
+        for layer, record in self.shape_layers():
+            add_index_visibility_driver(layer, self.armature, self.shape_index(record))
+
+    def build_time_offset_switcher(self):
+        """Renumber the shape keyframes to slot order and pick one with a fixed-frame Time Offset modifier"""
+        gp_obj = self.gp_obj
+        moves = [(record.frame_number, self.shape_index(record)) for record in self.shape_records]
+        for layer in gp_obj.data.layers:
+            existing = {frame.frame_number for frame in layer.frames}
+            layer_moves = [(frame_number, index) for frame_number, index in moves if frame_number in existing]
+            # Park the frames out of the way first so renumbering never collides
+            for frame_number, index in layer_moves:
+                layer.frames.move(frame_number, 100000 + index)
+            for frame_number, index in layer_moves:
+                layer.frames.move(100000 + index, index + 1)
+
+        time_mod = gp_obj.modifiers.new(name="Shape Frame Switcher", type='GREASE_PENCIL_TIME')
+        time_mod.mode = 'FIX'
+        time_mod.offset = 1
+        gp_obj.modifiers.move(gp_obj.modifiers.find(time_mod.name), 0)
+
+        driver = time_mod.driver_add("offset").driver
+        driver.type = 'SCRIPTED'
+        add_shape_index_variable(driver, self.armature)
+        driver.expression = "idx + 1"
+
+    def build_geometry_nodes_switcher(self):
+        """Tag every layer with its shape index and let a Geometry Nodes modifier delete the inactive ones"""
+        gp_obj = self.gp_obj
+        write_layer_shape_indices(gp_obj, {layer.name: self.shape_index(record) for layer, record in self.shape_layers()})
+
+        node_group = ensure_shape_switcher_node_group()
+        switcher = gp_obj.modifiers.new(name="Shape Switcher", type='NODES')
+        switcher.node_group = node_group
+        # Drop the inactive layers before anything deforms them
+        gp_obj.modifiers.move(gp_obj.modifiers.find(switcher.name), 0)
+
+        socket_id = next(item.identifier for item in node_group.interface.items_tree
+                         if item.item_type == 'SOCKET' and item.in_out == 'INPUT' and item.name == "Shape Index")
+        driver = switcher.driver_add(f'["{socket_id}"]').driver
+        driver.type = 'SCRIPTED'
+        add_shape_index_variable(driver, self.armature)
+        driver.expression = "idx"
+
+    def build_lattice_hooks(self):
+        # Find the lattice object and add a CHILD_OF constraint to it
+        lattice = self.lattice
+        if not lattice:
+            return
+        tag_rig_object(lattice, self.rig_id, "Mouth Lattice")
+        lattice_constraint = lattice.constraints.new(type='CHILD_OF')
+        lattice_constraint.target = self.armature
+        lattice_constraint.subtarget = "GP Mouth Bone"
+
+        # Add hook modifiers to the lattice per vertex group
+        for bone_name, vert_indices in build_mouth_hook_map().items():
+            # Create a vertex group for these vertices
+            vg = lattice.vertex_groups.new(name=bone_name)
+            vg.add(vert_indices, 1.0, 'REPLACE')
+
+            # Add hook modifier pointing to the armature bone
+            hook_mod = lattice.modifiers.new(name=f"Hook_{bone_name}", type='HOOK')
+            hook_mod.object = self.armature
+            hook_mod.subtarget = bone_name          # the specific bone
+            hook_mod.vertex_group = bone_name       # only affects these verts
+
+    def build_thickness_driver(self):
+        # Add a modifier to the GP object to scale thickness corecctly using a driven value
+        thick_mod = self.gp_obj.modifiers.new(name="BoneThickness", type='GREASE_PENCIL_THICKNESS')
+        thick_mod.thickness_factor = 1.0  # start at 1.0
+
+        # Drive the thickness factor from the bone scale
+        driver = thick_mod.driver_add("thickness_factor").driver
+        driver.type = 'SCRIPTED'
+
+        var = driver.variables.new()
+        var.name = "s"
+        var.type = 'TRANSFORMS'
+        target = var.targets[0]
+        target.id = self.armature
+        target.bone_target = "GP Mouth Bone"
+        target.transform_type = 'SCALE_AVG'
+        target.transform_space = 'LOCAL_SPACE'
+
+        driver.expression = "abs(s)" #The engative value here prevents the thickness from being 0 when scale is negative, useful for chanigng direction of mouth
+
+
+# Might have to break these into separate classes for each element
+class CreateRig(bpy.types.Operator):
+    """Create the face rig based on the drawn mouth shapes and control board"""
+    bl_idname = "object.create_rig"
+    bl_label = "Create Rig"
+    bl_options = {'REGISTER', 'UNDO'}
+    
+    
+    # Set up 
+    # | GP Face Rig Root
+    #   |--> GP Mouth Bone/ labels/ canvas / Hooks (parented to root, has vertex group for mouth shapes)
+    #     |---> GP Object 
+    #     |---> Lattice via Constraints (Child of rig, AND constrained to GP Mouth Bone (Also has hook modifiers using vertex groups)
+    #     
+   
+   
+    rig_name: bpy.props.StringProperty(name="Rig Name", default="Character")
+    
+    def invoke(self, context, event):
+        return context.window_manager.invoke_props_dialog(self)
+
+    def draw(self, context):
+        layout = self.layout
+        layout.prop(self, "rig_name")
+        layout.prop(context.scene.grease_pencil_face_rig_settings, "shape_switch_mode")
+    
+    bone_definitions={
+        "GP Face Rig Root": {
+            "head": (0, .2, 0),
+            "tail": (0, .2, .25),
+            "deform": True,
+        },
+        "GP Mouth Bone": { # This is causing weird transforms when rotated - think I solved it by changing the bone head to 0,0,0
+            "head": (0, 0, 0),
+            "tail": (0, 0, .025),
+            "deform": True,
+        },
+        "shape_board": {
+            "head": (0, 0, 0),
+            "tail": (0, 0, 0.2),
+            "deform": False,
+        },
+        "Face_Main_Control_Board": {
+            "head": (.5,    0, .1),
+            "tail": (.5, 0, .3),
+            "deform": False,
+        },
+        "Label_Face_Main_Control_Board": {
             "head": (.5, 0, .3),
             "tail": (.5, 0, .5),
             "deform": False,
@@ -1685,21 +2841,11 @@ class CreateRig(bpy.types.Operator):
 
     def execute(self, context):
         rig_id = generate_unique_id()
-############################### Widget Creation/Import and Organization #######################
-
 
-
-
-############################### Face Control Board Creation ################################        
-        
-        
-        
-        
 ################################ Mouth Rig Creation ########################################
 
         # Get the active object
         gp_obj = context.active_object
-        tag_rig_object(gp_obj, rig_id, "Grease Pencil Main Shape")
         if gp_obj and gp_obj.type == 'GREASEPENCIL':
             vgroup_name = "GP Mouth Bone"
             if vgroup_name not in gp_obj.vertex_groups:
@@ -1707,471 +2853,32 @@ class CreateRig(bpy.types.Operator):
                 return {'CANCELLED'}
         else:
             self.report({'ERROR'}, "Active object is not a Grease Pencil object.")
-            return {'CANCELLED'}   
-        # Retrieve control board and puck locations
-        collection_name = "Mouth Rig Control Board Objects"
-        collection = bpy.data.collections.get(collection_name)
-            
-
-
-        
-        bpy.ops.object.armature_add(enter_editmode=True, location=(0, 0, 0))
-        armature = context.object
-        armature.name = "GP_Rig"
-        arm_data = armature.data
-        tag_rig_object(armature, rig_id, "Main Armature")
-        bpy.ops.object.mode_set(mode='EDIT')
-
-        # Access the armature's edit bones
-        bones = armature.data.edit_bones
-        #Create bone collections
-        bpy.ops.object.mode_set(mode='EDIT')
-        if "Bones" in arm_data.collections:
-            arm_data.collections.remove(arm_data.collections.get("Bones"))
-        if "Face" not in arm_data.collections:
-            face_coll = arm_data.collections.new("Face")
-        else:
-            face_coll = arm_data.collections["Face"]
-        mouth_coll = arm_data.collections.new("Mouth Bones", parent = face_coll)
-        eyes_coll = arm_data.collections.new("Eyes Bones", parent =face_coll)
-        nose_coll = arm_data.collections.new("Nose Bones", parent =face_coll)
-        hid_coll = arm_data.collections.new("Hidden Bones", parent =face_coll)
-        hid_coll.is_visible=False
-        hid_mouth_coll = arm_data.collections.new("Hidden Mouth Bones", parent =hid_coll)
-        hid_eyes_coll = arm_data.collections.new("Hidden Eyes Bones", parent =hid_coll)
-        hid_brows_coll = arm_data.collections.new("Hidden Eyebrow Bones", parent =hid_coll)
-        hid_nose_coll = arm_data.collections.new("Hidden Nose Bones", parent =hid_coll)
-        
-
-        # Create the root bone, it's slightly offset
-        # from the mouth to be in the center of the head it'll join with
-        root_bone = bones[0]
-        root_bone.name = "GP Face Rig Root"
-        root_bone.head = self.bone_definitions["GP Face Rig Root"]["head"]
-        root_bone.tail = self.bone_definitions["GP Face Rig Root"]["tail"]
-        face_coll.assign(root_bone)
+            return {'CANCELLED'}
+        tag_rig_object(gp_obj, rig_id, "Grease Pencil Main Shape")
 
-        # Create the named bone and place it in middle of Lattice
-        
-        gp_obj = context.active_object
-        if gp_obj and gp_obj.type == 'GREASEPENCIL':
-            vgroup_name = "GP Mouth Bone"
-        named_bone = bones.new(vgroup_name)
-        named_bone.head = (self.bone_definitions["GP Mouth Bone"]["head"])
-        named_bone.tail = (self.bone_definitions["GP Mouth Bone"]["tail"])
-        named_bone.parent = root_bone
-        named_bone.use_connect = False
-        
-        hid_mouth_coll.assign(named_bone)
-        
         # Retrieve control board and puck locations
         collection_name = "Mouth Rig Control Board Objects"
         collection = bpy.data.collections.get(collection_name)
-
         if collection is None:
             self.report({'ERROR'}, f"Collection '{collection_name}' not found.")
             return {'CANCELLED'}
 
-        shape_board = None
-        puck = None
-        for obj in collection.objects:
-            if obj.name == "Mouth Shapes Control Plane":
-                
-                shape_board = obj
-                obj.hide_viewport = True
-            elif obj.name == "Mouth Shape Control Selector":
-                puck = obj
-                puck.hide_viewport =True
-            
-        if not shape_board or not puck:
+        settings = context.scene.grease_pencil_face_rig_settings
+        if settings.shape_switch_mode == 'FRAMES' and not len(context.scene.gp_mouth_shapes):
+            self.report({'ERROR'}, "Shape Frames mode needs mouth shapes finished in that mode. Pick another shape switching mode.")
+            return {'CANCELLED'}
+        builder = MouthRigBuilder(context, gp_obj, collection, rig_id, self.bone_definitions, settings.shape_switch_mode)
+        if not builder.find_board_objects():
             self.report({'ERROR'}, "Shape board or Selector not found in the collection.")
             return {'CANCELLED'}
-        
-        
-        
-        
-        # Create the control board bone
-        shape_board_bone = bones.new("shape_board_bone")
-        shape_board_bone.head = shape_board.location
-        shape_board_bone.tail = (shape_board.location.x, shape_board.location.y, shape_board.location.z + shape_board.scale.z)
-        shape_board_bone.parent = root_bone
-        shape_board_bone.use_connect = False
-        shape_board_bone.use_deform = False
-        shape_board_bone.show_wire = True
-        mouth_coll.assign(shape_board_bone)
-        
-        # Create the puck control bone
-        mouth_puck_control_bone = bones.new("mouth_puck_control")
-        mouth_puck_control_bone.head = puck.location
-        mouth_puck_control_bone.tail = (puck.location.x, puck.location.y, puck.location.z + 0.2)
-        mouth_puck_control_bone.parent = shape_board_bone
-        mouth_puck_control_bone.use_connect = False
-        mouth_coll.assign(mouth_puck_control_bone)
-        
-        #Create Bones for each GP object in the other collection and set them to hide
-        bone_names = []
-        for obj in collection.objects:
-            if obj.type== 'GREASEPENCIL':
-                bone_names.append(obj.name)
-                
-        
-        if collection and armature and armature.type == 'ARMATURE':
-            bpy.context.view_layer.objects.active = armature
-            bpy.ops.object.mode_set(mode='EDIT')
-            arm_data = armature.data
-    
-            shape_board_bone = arm_data.edit_bones.get("shape_board_bone")
-    
-        for obj in collection.objects:
-            if obj.type == 'GREASEPENCIL':
-                bone_name = f"{obj.name}_Shape_Bone"
-                print(f"Creating bone for: {bone_name}")
-            
-                bone = arm_data.edit_bones.new(bone_name)
-                bone.head = obj.location
-                bone.tail = (obj.location.x, obj.location.y, obj.location.z + 0.2)
-                hid_mouth_coll.assign(arm_data.edit_bones.get(bone_name)) 
-                #add shrinkwrap to each bone to the control board
-#                bpy.ops.object.mode_set(mode='POSE')
-#                pose_bones = armature.pose.bones
-#                pose_bone_mouth_shape = pose_bones[bone_name]
-#                shrinkwrap = pose_bone_mouth_shape.constraints.new('SHRINKWRAP')
-#                shrinkwrap.target = control_board
-#                shrinkwrap.wrap_mode = 'ON_SURFACE'
-#                bpy.ops.object.mode_set(mode='EDIT')
-            
-            if shape_board_bone:
-                bone.parent = shape_board_bone
-    
-    # back to object mode
-        bpy.ops.object.mode_set(mode='OBJECT')
-    
-        
-    
-    # now add constraints in Object mode
-        for obj in collection.objects:
-            if obj.type == 'GREASEPENCIL':
-                bone_name = f"{obj.name}_Shape_Bone"
-            
-                constraint = obj.constraints.new('CHILD_OF')
-                constraint.target = armature
-                constraint.subtarget = bone_name
-            
-        
-                bpy.context.view_layer.objects.active = obj
-                bpy.ops.constraint.childof_set_inverse(constraint=constraint.name, owner='OBJECT')
-            if obj.name == "Mouth Shapes Control Plane":
-                constraint = obj.constraints.new('CHILD_OF')
-                bone_name = "shape_board_bone"
-                constraint.target = armature
-                constraint.subtarget = bone_name
-                bpy.ops.constraint.childof_set_inverse(constraint=constraint.name, owner='OBJECT')
-                
-
-        bpy.context.view_layer.update()
-        print("All bones created and constraints added.")
-
-                
 
-    
-                  
-        # Switch back to the armature
-        bpy.context.view_layer.objects.active = armature  
-        # Switch to pose mode to set custom shapes & visbility rules
-        bpy.ops.object.mode_set(mode='POSE')
-        # Access the pose bones
-        pose_bones = armature.pose.bones
-        # Set custom shapes (ensure you have created custom bone shapes named 'ControlBoardShape' and 'PuckShape')
-        if 'Mouth Shapes Control Plane' in bpy.data.objects:
-            shape_board_bone_obj = pose_bones["shape_board_bone"]
-            shape_board_bone_obj.custom_shape = bpy.data.objects['Mouth Shapes Control Plane']
-            
-            shape_board_bone_obj.use_custom_shape_bone_size = False
-            #for child_bone in shape_board_bone_obj.children:
-                # child_bone.bone.hide = True
-
-        if 'Mouth Shape Control Selector' in bpy.data.objects:
-            mouth_puck_control_bone_obj = pose_bones["mouth_puck_control"]
-            mouth_puck_control_bone_obj.custom_shape = bpy.data.objects['Mouth Shape Control Selector']
-            mouth_puck_control_bone_obj.use_custom_shape_bone_size = False
-            mouth_puck_control_bone_obj.bone.hide = False
-        
-        # Add shrinkwrap constraint to the puck bone
-        shrinkwrap = mouth_puck_control_bone_obj.constraints.new('SHRINKWRAP')
-        shrinkwrap.target = shape_board
-        shrinkwrap.wrap_mode = 'ON_SURFACE'
-        # shrinkwrap.use_keep_above_surface = True
-
-        # Switch back to object mode
-        bpy.ops.object.mode_set(mode='OBJECT')
-        bpy.ops.object.select_all(action='DESELECT')
-        
-
-        # Parent the GP object to the armature with weights previously defined
-        # Might not need this? Seems to work without parenting, but keeping here just in case
-        gp_obj = bpy.data.objects["GP Temp Face Object"]
-        gp_obj.select_set(True)
-        gp_obj.parent = armature
-        gp_obj.parent_type = 'ARMATURE'
-        arm_mod = gp_obj.modifiers.new(name="ArmatureDeform", type='GREASE_PENCIL_ARMATURE')
-        arm_mod.object = armature
-        arm_mod.use_vertex_groups = True
-        
-        
-       
-        
-
-        # Set up drivers for layer visibility using bones
-        gp_obj = bpy.data.objects["GP Temp Face Object"]
-        gp_obj.select_set(True)
-        
-        for layer in gp_obj.data.layers:
-            for bone_name in bone_names:
-                
-                layer_pattern = re.compile(f"^{re.escape(bone_name.replace(' Shape Bone', ''))}(\\.\\d+)?$")
-                bone_name = bone_name + "_Shape_Bone"
-                if layer_pattern.match(layer.name):
-                    driver = layer.driver_add("hide").driver
-                    driver.type = 'SCRIPTED'
-                
-                    var1 = driver.variables.new()
-                    var1.name = "puck_x"
-                    var1.type = 'TRANSFORMS'
-                    var1.targets[0].id = armature
-                    var1.targets[0].bone_target = "mouth_puck_control"
-                    var1.targets[0].transform_type = 'LOC_X'
-                    var1.targets[0].transform_space = 'WORLD_SPACE'
-                    
-                    var2 = driver.variables.new()
-                    var2.name = "bone_x"
-                    var2.type = 'TRANSFORMS'
-                    var2.targets[0].id = armature
-                    var2.targets[0].bone_target = bone_name
-                    var2.targets[0].transform_type = 'LOC_X'
-                    var2.targets[0].transform_space = 'WORLD_SPACE'
-                    
-                    var3 = driver.variables.new()
-                    var3.name = "puck_z"
-                    var3.type = 'TRANSFORMS'
-                    var3.targets[0].id = armature
-                    var3.targets[0].bone_target = "mouth_puck_control"
-                    var3.targets[0].transform_type = 'LOC_Z'
-                    var3.targets[0].transform_space = 'WORLD_SPACE'
-                    
-                    var4 = driver.variables.new()
-                    var4.name = "bone_z"
-                    var4.type = 'TRANSFORMS'
-                    var4.targets[0].id = armature
-                    var4.targets[0].bone_target = bone_name
-                    var4.targets[0].transform_type = 'LOC_Z'
-                    var4.targets[0].transform_space = 'WORLD_SPACE'
-                    
-                    driver.expression = "(abs(puck_x - bone_x) > 0.1) or (abs(puck_z - bone_z) > 0.1)"
-                    
-
-   
-
-        
-         # Ensure the control board and puck bones follow the objects
-        shape_board_bone_obj = armature.pose.bones["shape_board_bone"]
-        mouth_puck_control_bone_obj = armature.pose.bones["mouth_puck_control"]
-        
-        childof_puck = puck.constraints.new('CHILD_OF')
-        childof_puck.target = armature
-        childof_puck.subtarget = "mouth_puck_control"
-        
-
-        # Add the armature to the same collection as the Grease Pencil object
-        collection = gp_obj.users_collection[0]
-        if armature.users_collection:
-            for coll in armature.users_collection:
-                coll.objects.unlink(armature)
-            collection.objects.link(armature)
-            
-        # Find the lattice object and add a CHILD_OF constraint to it
-        lattice = bpy.data.objects.get("GPMouthLattice")
-        if lattice:
-            tag_rig_object(lattice, rig_id, "Mouth Lattice")
-            lattice_constraint = lattice.constraints.new(type =  'CHILD_OF')
-            lattice_constraint.target = bpy.data.objects["GP_Rig"]
-            
-            lattice_constraint.subtarget = "GP Mouth Bone"
-        # Create bones for lattice and assign vertex groups to vertices to mouth bone - set to linear -- actually bspline is fine 
-            hook_map = build_mouth_hook_map()
-            bpy.context.view_layer.objects.active = armature
-            bpy.ops.object.mode_set(mode='EDIT')
-            
-            edit_bones = armature.data.edit_bones
-            
-            #Direct Lattice Control Bones
-            bone_positions = {
-            
-                "Mouth_Top_L":     ((.08, 0, .02), (.08, 0, 0.04)),
-                "Mouth_Top_C":     ((0, 0, .02),    (0, 0, 0.04)),
-                "Mouth_Top_R":     ((-.08, 0, .02),  (-.08, 0, 0.04)),
-                "Mouth_Bot_L":     ((.08, 0, -.04), (.08, 0, -0.02)),
-                "Mouth_Bot_C":     ((0, 0, -.04),    (0, 0, -0.02)),
-                "Mouth_Bot_R":     ((-.08, 0, -.04),  (-.08, 0, -0.02)),
-                #"Mouth_Depth":     ((0, 0, -0.3), (0, 0, 0.4)), -
-            
-            }
-
-            for bone_name, (head, tail) in bone_positions.items():
-                if bone_name not in edit_bones:
-                    bone = edit_bones.new(bone_name)
-                    bone.head = head
-                    bone.tail = tail
-                    bone.parent = edit_bones.get("GP Mouth Bone")  # parent to existing mouth bone
-                    hid_mouth_coll.assign(bone)
-                    
-
-            bpy.ops.object.mode_set(mode='OBJECT')
-
-            # --- Step 1: Add hook modifiers to the lattice per vertex group ---
-            bpy.context.view_layer.objects.active = lattice
-            
-            x = 0
-
-            for bone_name, vert_indices in hook_map.items():
-                
-                # Create a vertex group for these vertices
-                vg = lattice.vertex_groups.new(name=bone_name)
-                vg.add(vert_indices, 1.0, 'REPLACE')
-
-                # Add hook modifier pointing to the armature bone
-                hook_mod = lattice.modifiers.new(name=f"Hook_{bone_name}", type='HOOK')
-                hook_mod.object = armature
-                hook_mod.subtarget = bone_name          # the specific bone
-                hook_mod.vertex_group = bone_name       # only affects these verts
-                
-                
-            # # --- Step 2: Set lattice interpolation to linear ---
-            # lattice.data.interpolation_type_u = 'KEY_LINEAR'
-            # lattice.data.interpolation_type_v = 'KEY_LINEAR'
-            # lattice.data.interpolation_type_w = 'KEY_LINEAR'
-            
-            #bpy.ops.object.modifier_add(type='GREASE_PENCIL_THICKNESS')
-
-            # --- Step 3: Add a modifier to the GP object to scale thickness corecctly using a driven value
-        thick_mod = gp_obj.modifiers.new(
-            name="BoneThickness", 
-            type='GREASE_PENCIL_THICKNESS'
-        )
-        thick_mod.thickness_factor = 1.0  # start at 1.0 
-
-        # Drive the thickness factor from the bone scale
-        fcurve = thick_mod.driver_add("thickness_factor")
-        driver = fcurve.driver
-        driver.type = 'SCRIPTED'
-
-        var = driver.variables.new()
-        var.name = "s"
-        var.type = 'TRANSFORMS'
-
-        target = var.targets[0]
-        target.id = armature
-        target.bone_target = "GP Mouth Bone"
-        target.transform_type = 'SCALE_AVG'
-        target.transform_space = 'LOCAL_SPACE'
-
-        driver.expression = "abs(s)" #The engative value here prevents the thickness from being 0 when scale is negative, useful for chanigng direction of mouth
-    
-            
-        # lattice_constraint.childof_set_inverse(constraint="Child Of", owner='OBJECT')
-        ##### Create Mouth Face Rig Control Panel #####
-        #Create control bones
-        bpy.ops.object.mode_set(mode='OBJECT')
-        bpy.context.view_layer.objects.active = armature
-        bpy.ops.object.mode_set(mode='EDIT')
-        #Main control Board
-        main_control_bone = edit_bones.new("Face_Main_Control_Board")
-        main_control_bone.head = self.bone_definitions["Face_Main_Control_Board"]["head"]
-        main_control_bone.tail = self.bone_definitions["Face_Main_Control_Board"]["tail"]
-        main_control_bone.parent = edit_bones.get("GP Face Rig Root")
-        main_control_bone.use_connect = False
-        mouth_coll.assign(main_control_bone)
-        
-        #Main Control Board Label
-        main_control_label_bone = edit_bones.new("Label_Face_Main_Control_Board")
-        main_control_label_bone.head = self.bone_definitions["Label_Face_Main_Control_Board"]["head"]
-        main_control_label_bone.tail = self.bone_definitions["Label_Face_Main_Control_Board"]["tail"]
-        main_control_label_bone.parent = edit_bones.get("Face_Main_Control_Board")
-        main_control_label_bone.use_connect = False
-        mouth_coll.assign(main_control_label_bone)
-        
-        #Canvas bone
-        mouth_position_canvas_bone = edit_bones.new("Face_Mouth_Canvas")
-        mouth_position_canvas_bone.head = self.bone_definitions["Face_Mouth_Canvas"]["head"]
-        mouth_position_canvas_bone.tail = self.bone_definitions["Face_Mouth_Canvas"]["tail"]
-        mouth_position_canvas_bone.parent = main_control_bone
-        mouth_position_canvas_bone.use_connect = False
-        mouth_coll.assign(mouth_position_canvas_bone)
-        
-        
-        #Mouth position controller
-        mouth_position_control_bone = edit_bones.new("Face_Mouth_Position_Control")
-        mouth_position_control_bone.head = self.bone_definitions["Face_Mouth_Position_Control"]["head"]
-        mouth_position_control_bone.tail = self.bone_definitions["Face_Mouth_Position_Control"]["tail"] 
-        mouth_position_control_bone.parent = mouth_position_canvas_bone
-        mouth_position_control_bone.use_connect = False
-        mouth_coll.assign(mouth_position_control_bone)
-        
-        #Mouth Position Label Bone
-        mouth_label_bone = edit_bones.new("Label_Mouth_Position_Control")
-        mouth_label_bone.head = self.bone_definitions["Label_Mouth_Position_Control"]["head"]
-        mouth_label_bone.tail = self.bone_definitions["Label_Mouth_Position_Control"]["tail"]
-        mouth_label_bone.parent = mouth_position_canvas_bone
-        mouth_label_bone.use_connect = False
-        mouth_coll.assign(mouth_label_bone)
-        
-        
+        armature = builder.build()
+        # The rig keeps its own shape records, the scene list is for the next drawing session
+        copy_shape_records(context.scene.gp_mouth_shapes, armature.gp_face_shapes)
+        context.scene.gp_mouth_shapes.clear()
+        print("All bones created and constraints added.")
 
-        bpy.ops.object.mode_set(mode='POSE')
-        mouth_pose_bone = armature.pose.bones.get("GP Mouth Bone")
-        copy_transform = mouth_pose_bone.constraints.new('COPY_TRANSFORMS')
-        copy_transform.target = armature
-        copy_transform.subtarget = "Face_Mouth_Position_Control"
-        copy_transform.mix_mode = 'AFTER_SPLIT'
-        copy_transform.target_space = 'LOCAL_OWNER_ORIENT'
-        copy_transform.owner_space = 'LOCAL'
-        
-        control_hook_bone_positions = {
-        
-            "Mouth_Top_L":     (self.bone_definitions["Hook_Mouth_Top_L"]["head"], self.bone_definitions["Hook_Mouth_Top_L"]["tail"]),
-            "Mouth_Top_C":     (self.bone_definitions["Hook_Mouth_Top_C"]["head"], self.bone_definitions["Hook_Mouth_Top_C"]["tail"]),
-            "Mouth_Top_R":     (self.bone_definitions["Hook_Mouth_Top_R"]["head"], self.bone_definitions["Hook_Mouth_Top_R"]["tail"]),
-            "Mouth_Bot_L":     (self.bone_definitions["Hook_Mouth_Bot_L"]["head"], self.bone_definitions["Hook_Mouth_Bot_L"]["tail"]),
-            "Mouth_Bot_C":     (self.bone_definitions["Hook_Mouth_Bot_C"]["head"], self.bone_definitions["Hook_Mouth_Bot_C"]["tail"]),
-            "Mouth_Bot_R":     (self.bone_definitions["Hook_Mouth_Bot_R"]["head"], self.bone_definitions["Hook_Mouth_Bot_R"]["tail"]),
-            #"Mouth_Depth":     ((0, 0, -0.3), (0, 0, 0.4)), -
-        
-        }
-        
-        for bone_name, (head, tail) in control_hook_bone_positions.items():
-            bpy.ops.object.mode_set(mode='EDIT')
-            hook_control_bone_name = bone_name.replace("Mouth_", "Hook_Mouth_")
-            if hook_control_bone_name not in edit_bones:
-                bone = edit_bones.new(hook_control_bone_name)
-                # Get relative positions and add them to the Face_Mouth_Position_Control bone's head and tail positions
-                head = tuple(Vector(head) + Vector((self.bone_definitions["Face_Mouth_Position_Control"]["head"])))
-                tail = tuple(Vector(tail) + Vector((self.bone_definitions["Face_Mouth_Position_Control"]["tail"])))
-                bone.head = head 
-                bone.tail = tail
-                bone.parent = edit_bones.get("Face_Mouth_Position_Control")  
-                mouth_coll.assign(bone)
-                bpy.ops.object.mode_set(mode='POSE')
-                # Add a copy transforms constraint to the helper controls for each of these bones
-                pose_bone = armature.pose.bones.get(bone_name)
-                copy_transforms = pose_bone.constraints.new('COPY_TRANSFORMS')
-                copy_transforms.target = armature
-                copy_transforms.subtarget = hook_control_bone_name
-                copy_transforms.mix_mode = 'AFTER_SPLIT'
-                copy_transforms.target_space = 'LOCAL_OWNER_ORIENT'
-                copy_transforms.owner_space = 'LOCAL'
-        
         #Clean up: Delete all helper objects, change collection names, reset modes, and parent the armature to the main control board
-        setup_control_board_shapes(armature)
-        
         main_drawing_collection = bpy.data.collections.get("Temp Drawing Collection") 
         main_drawing_collection.name = "GP Face Rig Drawing Collection"
         context.scene.has_setup_been_run = False
@@ -2206,13 +2913,13 @@ class CreateRig(bpy.types.Operator):
             return {'CANCELLED'}
     
         name = self.rig_name
-        settings = context.scene.grease_pencil_face_rig_settings
         settings.rig_name = name
     
         renames = {
             "GP Mouth Rig": f"{name}_Mouth_Rig",
             "Mouth Shapes Control Plane": f"{name}_Mouth_Shapes_Control_Plane",
             "Mouth Shape Control Selector": f"{name}_Mouth_Shape_Control_Selector",
+            "Mouth Shape Labels": f"{name}_Mouth_Shape_Labels",
             "GP Face Rig Drawing Collection": f"{name}_Face_Rig_Collection",
             "Mouth Rig Control Board Objects": f"{name}_Control_Board_Collection",
             "BoneShapes": f"{name}_BoneShapes",
@@ -2230,17 +2937,1100 @@ class CreateRig(bpy.types.Operator):
             if col.name in renames:
                 col.name = renames[col.name]
                 
-        
-        bpy.ops.object.select_all(action='DESELECT')
+        # Leave the Grease Pencil object selected and active, without going through the selection operators
+        for obj in context.selected_objects:
+            obj.select_set(False)
         gp_obj.select_set(True)
-        bpy.context.view_layer.objects.active = gp_obj
-        bpy.ops.object.mode_set(mode='OBJECT')
-        
-        bpy.ops.object.modifier_move_up(modifier="ArmatureDeform")
+        context.view_layer.objects.active = gp_obj
+
         self.report({'INFO'}, "Rig successfully created.")
         return {'FINISHED'}
         
         
+############################### Add Shape to Rig ########################
+
+def get_target_face_rig(context):
+    """The selected face rig, else the one picked in the panel, else the first one in the file"""
+    face_rig = context.scene.target_rig_settings.face_rig
+    if face_rig and not face_rig.get("is_Atta_gp_face_rig"):
+        face_rig = None
+    return get_face_rig_from_selection(context) or face_rig or find_rig(context)
+
+def rig_shape_switch_mode(armature, gp_obj):
+    """Shape switching mode of a finished rig. Rigs built before it was stored are told apart by their modifiers."""
+    mode = armature.get("shape_switch_mode")
+    if mode:
+        return mode
+    if gp_obj.modifiers.get("Shape Frame Switcher"):
+        return 'FRAMES'
+    if gp_obj.modifiers.get("Shape Switcher"):
+        return 'GEONODES'
+    if "active_shape_index" in armature:
+        return 'INDEX'
+    return 'DISTANCE'
+
+def rig_board_layout(armature):
+    """Slot grid of a finished rig relative to its board bone: origin and spacing in X/Z, and the number of columns"""
+    if "shape_slot_origin" in armature:
+        return (tuple(armature["shape_slot_origin"]), tuple(armature["shape_slot_spacing"]),
+                int(armature["shape_board_columns"]))
+    board_head = armature.data.bones["shape_board_bone"].head_local
+    origin_x, origin_z = MouthRigBuilder.default_slot_origin
+    return ((origin_x - board_head.x, origin_z - board_head.z), MouthRigBuilder.default_slot_spacing,
+            MouthRigBuilder.default_board_columns)
+
+def get_rig_shape_labels(armature):
+    """The merged label mesh of a rig built with Merge Shape Labels, or None when every label is its own object"""
+    labels = get_rig_object_by_role(get_rig_id(armature), "Shape Labels")
+    if labels is None:
+        # Rigs built before the labels were tagged
+        labels = next((obj for obj in bpy.data.objects
+                       if obj.type == 'MESH' and obj.name.endswith(("Mouth_Shape_Labels", "Mouth Shape Labels"))
+                       and any(c.type == 'CHILD_OF' and c.target == armature for c in obj.constraints)), None)
+    return labels
+
+def append_label_to_merged(labels, label_mesh, armature, location):
+    """Add a label's geometry to the merged label mesh so it shows at location (armature rest space)"""
+    child_of = next((c for c in labels.constraints if c.type == 'CHILD_OF' and c.target == armature), None)
+    if child_of is not None and child_of.subtarget in armature.data.bones:
+        # Undo what the Child Of applies at rest: board bone rest matrix, its inverse and the object's own transform
+        to_labels = (armature.data.bones[child_of.subtarget].matrix_local @ child_of.inverse_matrix
+                     @ labels.matrix_basis).inverted()
+    else:
+        to_labels = labels.matrix_world.inverted() @ armature.matrix_world
+    bm = bmesh.new()
+    bm.from_mesh(label_mesh)
+    bm.transform(to_labels @ Matrix.Translation(location))
+    # from_mesh appends, so the existing labels follow the new one
+    bm.from_mesh(labels.data)
+    bm.to_mesh(labels.data)
+    bm.free()
+    labels.data.update()
+
+def get_pending_shape_rig(context):
+    """The rig with a shape started by 'Draw New Shape' that was not added yet"""
+    obj = context.active_object
+    if obj is not None and obj.get("rig_role") == "Grease Pencil Main Shape":
+        armature = get_rig_object_by_role(get_rig_id(obj), "Main Armature")
+    else:
+        armature = get_target_face_rig(context)
+    if armature is None or "new_shape_layer" not in armature:
+        return None
+    return armature
+
+def next_board_slot(records):
+    slots = [record.board_slot for record in records if record.board_slot >= 0]
+    return max(slots) + 1 if slots else len(records)
+
+def grow_shape_board(armature, bottom):
+    """Move the bottom edge of the control plane down to bottom (relative to the board bone) if it's above it.
+    Returns True when the plane grew."""
+    board = armature.pose.bones["shape_board_bone"].custom_shape
+    if board is None or board.type != 'MESH':
+        return False
+    mesh = board.data
+    co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", co)
+    co = co.reshape(-1, 3)
+    # The plane keeps its 90 degree X rotation, so its local Y runs down the board
+    bottom_y = co[:, 1].min()
+    if bottom >= bottom_y - 1e-5:
+        return False
+    co[np.isclose(co[:, 1], bottom_y), 1] = bottom
+    mesh.vertices.foreach_set("co", co.ravel())
+    mesh.update()
+    return True
+
+
+class MY_OT_draw_rig_shape(bpy.types.Operator):
+    """Start drawing a new mouth shape for a finished face rig"""
+    bl_idname = "my.draw_rig_shape"
+    bl_label = "Draw New Shape"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @classmethod
+    def poll(cls, context):
+        return context.mode == 'OBJECT' and get_target_face_rig(context) is not None
+
+    def execute(self, context):
+        armature = get_target_face_rig(context)
+        gp_obj = get_rig_object_by_role(get_rig_id(armature), "Grease Pencil Main Shape")
+        if gp_obj is None:
+            self.report({'ERROR'}, f"No Grease Pencil mouth found for {armature.name}.")
+            return {'CANCELLED'}
+        if "new_shape_layer" in armature:
+            self.report({'WARNING'}, "Add or cancel the shape already being drawn first.")
+            return {'CANCELLED'}
+
+        if rig_shape_switch_mode(armature, gp_obj) == 'FRAMES':
+            # Every shape is a keyframe on the same layer, the new one goes after the last
+            record = next((record for record in armature.gp_face_shapes if len(record.layer_names)), None)
+            layer = gp_obj.data.layers.get(record.layer_names[0].name) if record else None
+            if layer is None:
+                self.report({'ERROR'}, "The rig's shape layer could not be found.")
+                return {'CANCELLED'}
+            frame_number = max((frame.frame_number for frame in layer.frames), default=0) + 1
+            layer.frames.new(frame_number)
+            context.scene.frame_current = frame_number
+            # The Time Offset modifier would keep showing the active shape instead of the new frame.
+            # 'Add Shape to Rig' or 'Cancel New Shape' turn it back on
+            switcher = gp_obj.modifiers.get("Shape Frame Switcher")
+            if switcher:
+                switcher.show_viewport = False
+        else:
+            layer = gp_obj.data.layers.new("New Mouth Layer", set_active=True)
+            frame_number = 1
+            layer.frames.new(frame_number)
+            if gp_obj.modifiers.get("Shape Switcher"):
+                # Keep the new layer out of the switcher until it has a slot
+                write_layer_shape_indices(gp_obj, {layer.name: -1})
+        gp_obj.data.layers.active = layer
+        armature["new_shape_layer"] = layer.name
+        armature["new_shape_frame"] = frame_number
+
+        for obj in context.selected_objects:
+            obj.select_set(False)
+        gp_obj.select_set(True)
+        context.view_layer.objects.active = gp_obj
+        bpy.ops.object.mode_set(mode='PAINT_GREASE_PENCIL')
+        self.report({'INFO'}, "Draw the new shape, name it and click 'Add Shape to Rig'.")
+        return {'FINISHED'}
+
+
+class MY_OT_add_shape_to_rig(bpy.types.Operator):
+    """Add the shape drawn with 'Draw New Shape' to the finished rig.
+    Only the new shape's bone, board copy, label and layer switch are created, the rest of the rig is untouched"""
+    bl_idname = "my.add_shape_to_rig"
+    bl_label = "Add Shape to Rig"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @classmethod
+    def poll(cls, context):
+        gp_obj = context.active_object
+        return (gp_obj is not None and gp_obj.type == 'GREASEPENCIL'
+                and gp_obj.get("rig_role") == "Grease Pencil Main Shape")
+
+    def execute(self, context):
+        settings = context.scene.grease_pencil_face_rig_settings
+        name = settings.mouth_shape_name
+        gp_obj = context.active_object
+        armature = get_rig_object_by_role(get_rig_id(gp_obj), "Main Armature")
+        if armature is None or "new_shape_layer" not in armature:
+            self.report({'WARNING'}, "Start the shape with 'Draw New Shape' first.")
+            return {'CANCELLED'}
+        if not name:
+            self.report({'WARNING'}, "You should enter a name for the mouth shape")
+            return {'CANCELLED'}
+        records = armature.gp_face_shapes
+        if name in records or f"{name}_Shape_Bone" in armature.data.bones:
+            self.report({'WARNING'}, f"A shape with the name '{name}' already exists. Please choose a different name.")
+            return {'CANCELLED'}
+
+        layer = gp_obj.data.layers.get(armature["new_shape_layer"])
+        frame_number = armature["new_shape_frame"]
+        frame = layer.get_frame_at(frame_number) if layer else None
+        if frame is None or not len(frame.drawing.strokes):
+            self.report({'WARNING'}, "No shape drawn on the new layer")
+            return {'CANCELLED'}
+        mode = rig_shape_switch_mode(armature, gp_obj)
+        if context.mode != 'OBJECT':
+            bpy.ops.object.mode_set(mode='OBJECT')
+
+        # Next free board slot, in armature rest space
+        slot = next_board_slot(records)
+        (offset_x, offset_z), (spacing_x, spacing_z), columns = rig_board_layout(armature)
+        row, column = divmod(slot, columns)
+        board_bone = armature.data.bones["shape_board_bone"]
+        head = board_bone.head_local + Vector((offset_x + column * spacing_x, 0, offset_z - row * spacing_z))
+
+        # The shape bone is the only edit to the armature
+        for obj in context.selected_objects:
+            obj.select_set(False)
+        context.view_layer.objects.active = armature
+        bpy.ops.object.mode_set(mode='EDIT')
+        edit_bones = armature.data.edit_bones
+        bone = edit_bones.new(f"{name}_Shape_Bone")
+        bone.head = head
+        bone.tail = head + Vector((0, 0, 0.2))
+        bone.parent = edit_bones["shape_board_bone"]
+        bone.use_connect = False
+        hidden_bones = armature.data.collections_all.get("Hidden Mouth Bones")
+        if hidden_bones:
+            hidden_bones.assign(bone)
+        bone_name = bone.name
+        bpy.ops.object.mode_set(mode='OBJECT')
+
+        # Board copy of just the new drawing, next to the other copies
+        if mode != 'FRAMES':
+            layer.name = name
+        board_copy = copy_gp_layers(gp_obj, name, [layer.name], frame_number)
+        collection = next((record.gp_object.users_collection[0] for record in records
+                           if record.gp_object and record.gp_object.users_collection), gp_obj.users_collection[0])
+        collection.objects.link(board_copy)
+        board_copy.matrix_world = armature.matrix_world @ Matrix.Translation(head)
+        board_copy.hide_select = True
+        board_copy.hide_render = True
+        child_of = board_copy.constraints.new('CHILD_OF')
+        child_of.target = armature
+        child_of.subtarget = bone_name
+        child_of.inverse_matrix = child_of_rest_inverse(armature, bone_name)
+
+        # Label under the copy, sized like the ones made while drawing
+        label_scale = 0.04 / (len(name) * 0.2) if len(name) > 6 else 0.06
+        label_mesh = get_label_mesh(name, 1.0, (label_scale,) * 3, (math.pi / 2, 0, 0), align_y='CENTER')
+        merged_labels = get_rig_shape_labels(armature)
+        if merged_labels is not None:
+            append_label_to_merged(merged_labels, label_mesh, armature, head + Vector((0, 0, -0.1)))
+        else:
+            label = bpy.data.objects.new(f"{name}Text", label_mesh)
+            collection.objects.link(label)
+            label.parent = board_copy
+            label.location = (0, 0, -0.1)
+            label.hide_select = True
+            label.hide_render = True
+
+        # Switch the new layer, or keyframe, the same way as the rest of the rig
+        if mode == 'DISTANCE':
+            add_distance_visibility_driver(layer, armature, bone_name)
+        elif mode == 'INDEX':
+            add_index_visibility_driver(layer, armature, slot)
+        elif mode == 'GEONODES':
+            write_layer_shape_indices(gp_obj, {layer.name: slot})
+        else:
+            if frame_number != slot + 1:
+                layer.frames.move(frame_number, slot + 1)
+                frame_number = slot + 1
+            switcher = gp_obj.modifiers.get("Shape Frame Switcher")
+            if switcher:
+                switcher.show_viewport = True
+        assign_vertex_group_to_all_points(context, gp_obj, "GP Mouth Bone", layer_names={layer.name})
+
+        record = add_shape_record(records, name, board_copy, [layer.name], frame_number)
+        record.board_slot = slot
+        record.bone_name = bone_name
+        grow_shape_board(armature, offset_z - (row + 0.5) * spacing_z)
+
+        del armature["new_shape_layer"]
+        del armature["new_shape_frame"]
+        settings.mouth_shape_name = ""
+        mark_ui_state_dirty()
+        armature.select_set(False)
+        gp_obj.select_set(True)
+        context.view_layer.objects.active = gp_obj
+        self.report({'INFO'}, f"Added '{name}' to {armature.name} in board slot {slot + 1}.")
+        return {'FINISHED'}
+
+
+class MY_OT_cancel_rig_shape(bpy.types.Operator):
+    """Drop the shape started with 'Draw New Shape' and put the rig back the way it was"""
+    bl_idname = "my.cancel_rig_shape"
+    bl_label = "Cancel New Shape"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @classmethod
+    def poll(cls, context):
+        return get_pending_shape_rig(context) is not None
+
+    def execute(self, context):
+        armature = get_pending_shape_rig(context)
+        gp_obj = get_rig_object_by_role(get_rig_id(armature), "Grease Pencil Main Shape")
+        if context.mode != 'OBJECT':
+            bpy.ops.object.mode_set(mode='OBJECT')
+
+        if gp_obj is not None:
+            layer = gp_obj.data.layers.get(armature["new_shape_layer"])
+            if rig_shape_switch_mode(armature, gp_obj) == 'FRAMES':
+                # The layer holds every shape, only the new keyframe goes
+                frame_number = armature["new_shape_frame"]
+                if layer is not None and any(frame.frame_number == frame_number for frame in layer.frames):
+                    layer.frames.remove(frame_number)
+                switcher = gp_obj.modifiers.get("Shape Frame Switcher")
+                if switcher:
+                    switcher.show_viewport = True
+            elif layer is not None:
+                gp_obj.data.layers.remove(layer)
+
+        del armature["new_shape_layer"]
+        del armature["new_shape_frame"]
+        mark_ui_state_dirty()
+        self.report({'INFO'}, "New shape cancelled.")
+        return {'FINISHED'}
+
+
+############################### Bake ########################
+
+def update_use_baked_face(self, context):
+    """Swap a face rig's live mouth for its baked copy, or back. Whatever is switched off is disabled outright,
+    so the depsgraph stops evaluating its drivers and deformers."""
+    rig_id = get_rig_id(self)
+    baked = get_rig_object_by_role(rig_id, "Baked Face")
+    if baked is None:
+        return
+    use_baked = self.gp_face_use_baked
+    for role in ("Grease Pencil Main Shape", "Mouth Lattice"):
+        obj = get_rig_object_by_role(rig_id, role)
+        if obj:
+            obj.hide_viewport = obj.hide_render = use_baked
+    baked.hide_viewport = baked.hide_render = not use_baked
+
+def drawing_signature(drawing):
+    """Point positions and radii of a drawing, to spot frames that repeat the previous one"""
+    arrays = []
+    for name, field, width in (("position", "vector", 3), ("radius", "value", 1)):
+        attribute = drawing.attributes.get(name)
+        values = np.empty(len(attribute.data) * width if attribute else 0, dtype=np.float32)
+        if attribute:
+            attribute.data.foreach_get(field, values)
+        arrays.append(values)
+    return len(drawing.strokes), arrays
+
+def signatures_match(a, b):
+    return a is not None and a[0] == b[0] and all(np.array_equal(x, y) for x, y in zip(a[1], b[1]))
+
+
+class MY_OT_bake_face_animation(bpy.types.Operator):
+    """Bake the face rig over a frame range into one Grease Pencil object with a plain drawing per layer and frame,
+    without drivers, modifiers or constraints, for rendering and export"""
+    bl_idname = "my.bake_face_animation"
+    bl_label = "Bake Face Animation"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    frame_start: bpy.props.IntProperty(name="Start Frame", default=1)
+    frame_end: bpy.props.IntProperty(name="End Frame", default=250)
+
+    @classmethod
+    def poll(cls, context):
+        return context.mode == 'OBJECT' and get_target_face_rig(context) is not None
+
+    def invoke(self, context, event):
+        self.frame_start = context.scene.frame_start
+        self.frame_end = context.scene.frame_end
+        return context.window_manager.invoke_props_dialog(self)
+
+    def execute(self, context):
+        if self.frame_end < self.frame_start:
+            self.report({'WARNING'}, "The end frame is before the start frame")
+            return {'CANCELLED'}
+        armature = get_target_face_rig(context)
+        rig_id = get_rig_id(armature)
+        gp_obj = get_rig_object_by_role(rig_id, "Grease Pencil Main Shape")
+        if gp_obj is None:
+            self.report({'ERROR'}, f"No Grease Pencil mouth found for {armature.name}.")
+            return {'CANCELLED'}
+
+        # Bake from the live rig, replacing an earlier bake
+        armature.gp_face_use_baked = False
+        old_bake = get_rig_object_by_role(rig_id, "Baked Face")
+        if old_bake:
+            old_data = old_bake.data
+            bpy.data.objects.remove(old_bake, do_unlink=True)
+            if not old_data.users:
+                bpy.data.grease_pencils.remove(old_data)
+
+        gp_data = bpy.data.grease_pencils.new(f"{gp_obj.name}_Baked")
+        for material in gp_obj.data.materials:
+            gp_data.materials.append(material)
+        # One baked layer per source layer, so opacity, tint, blend mode and masks still apply per layer.
+        # The transform stays at rest, it is baked into the points
+        layer_pairs = []
+        for source_layer in gp_obj.data.layers:
+            layer = gp_data.layers.new(source_layer.name)
+            copy_layer_properties(source_layer, layer, transform=False)
+            layer_pairs.append((source_layer, layer))
+        baked = bpy.data.objects.new(gp_data.name, gp_data)
+        gp_obj.users_collection[0].objects.link(baked)
+        copy_layer_masks(context, baked, layer_pairs)
+        tag_rig_object(baked, rig_id, "Baked Face")
+
+        scene = context.scene
+        frame_current = scene.frame_current
+        previous = {}
+        keyed = 0
+        for frame_number in range(self.frame_start, self.frame_end + 1):
+            scene.frame_set(frame_number)
+            evaluated = gp_obj.evaluated_get(context.evaluated_depsgraph_get())
+            evaluated_layers = {layer.name: layer for layer in evaluated.data.layers}
+            for baked_layer in gp_data.layers:
+                drawing = baked_layer.frames.new(frame_number).drawing
+                # A hidden layer gets an empty drawing, so the shape before it doesn't hold
+                layer = evaluated_layers.get(baked_layer.name)
+                frame = layer.current_frame() if layer is not None and not layer.hide else None
+                if frame is not None:
+                    # Written in world space, so the baked object needs no parent or constraint
+                    matrix = np.array(evaluated.matrix_world @ layer.matrix_local)
+                    copy_drawing(frame.drawing, drawing, matrix)
+                # Grease Pencil keyframes hold until the next one, so a repeat of the previous drawing isn't keyed
+                signature = drawing_signature(drawing)
+                if signatures_match(previous.get(baked_layer.name), signature):
+                    baked_layer.frames.remove(frame_number)
+                else:
+                    previous[baked_layer.name] = signature
+                    keyed += 1
+        scene.frame_set(frame_current)
+
+        armature.gp_face_use_baked = True
+        self.report({'INFO'}, f"Baked frames {self.frame_start}-{self.frame_end} into {baked.name} ({keyed} drawings).")
+        return {'FINISHED'}
+
+
+############################### Lip Sync ########################
+
+# Shape names tried, in order, for every mouth cue code when no shape is named after the code itself.
+# Rhubarb uses the Preston Blair letters A-H and X, Papagayo (MOHO switch files) the phoneme names
+RHUBARB_SHAPE_ALIASES = {
+    "A": ("MBP", "M", "Closed"),
+    "B": ("etc", "Teeth", "E"),
+    "C": ("E", "EH", "Wide"),
+    "D": ("AI", "Open"),
+    "E": ("O", "Round"),
+    "F": ("U", "WQ", "OO"),
+    "G": ("FV", "F"),
+    "H": ("L",),
+    "X": ("Rest", "Closed", "MBP"),
+}
+PAPAGAYO_SHAPE_ALIASES = {
+    "AI": ("A", "D", "Open"),
+    "E": ("C", "Wide"),
+    "O": ("E", "Round"),
+    "U": ("F", "OO", "WQ"),
+    "etc": ("B", "Teeth"),
+    "L": ("H",),
+    "WQ": ("F", "U", "Round"),
+    "MBP": ("A", "M", "Closed"),
+    "FV": ("G", "F"),
+    "rest": ("X", "Rest", "Closed", "MBP"),
+}
+# foreach value of the CONSTANT keyframe interpolation
+KEYFRAME_CONSTANT = 0
+PUCK_LOCATION_PATH = 'pose.bones["mouth_puck_control"].location'
+
+def parse_lip_sync_file(path, fps, start_frame=1):
+    """Read a Rhubarb TSV (seconds and mouth shape per line) or a Papagayo/MOHO .dat switch file (frame and phoneme
+    per line) into (mouth cues as [(frame, code), ...] with repeats dropped, alias table)"""
+    with open(path) as cue_file:
+        lines = [line.split() for line in cue_file if line.strip()]
+    moho = bool(lines) and lines[0][0].lower().startswith("mohoswitch")
+    if moho:
+        lines = lines[1:]
+    cues = {}
+    for fields in lines:
+        if len(fields) < 2:
+            continue
+        try:
+            # MOHO frames count from 1
+            frame = start_frame + int(fields[0]) - 1 if moho else start_frame + round(float(fields[0]) * fps)
+        except ValueError:
+            continue
+        cues[frame] = fields[1]
+    mouth_cues = []
+    for frame in sorted(cues):
+        if not mouth_cues or mouth_cues[-1][1] != cues[frame]:
+            mouth_cues.append((frame, cues[frame]))
+    return mouth_cues, (PAPAGAYO_SHAPE_ALIASES if moho else RHUBARB_SHAPE_ALIASES)
+
+def resolve_cue_shapes(records, codes, aliases):
+    """Shape record name for every cue code: a shape named like the code, else the first alias found on the rig"""
+    names = {record.name.lower(): record.name for record in records if record.bone_name}
+    shapes = {}
+    for code in codes:
+        for candidate in (code, *aliases.get(code, ())):
+            if candidate.lower() in names:
+                shapes[code] = names[candidate.lower()]
+                break
+    return shapes
+
+def puck_slot_locations(armature):
+    """Puck bone location, in its own rest space, that puts the puck on each shape's slot, by shape name"""
+    bones = armature.data.bones
+    puck = bones["mouth_puck_control"]
+    to_puck = puck.matrix_local.to_3x3().inverted()
+    locations = {}
+    for record in armature.gp_face_shapes:
+        bone = bones.get(record.bone_name)
+        if bone is not None:
+            locations[record.name] = to_puck @ (bone.head_local - puck.head_local)
+    return locations
+
+def puck_fcurves(armature, create=False):
+    """X, Y and Z location F-curves of the puck bone in the armature's action.
+    Missing ones are created with create=True and None otherwise."""
+    anim_data = armature.animation_data
+    if anim_data is None:
+        if not create:
+            return [None] * 3
+        anim_data = armature.animation_data_create()
+    action = anim_data.action
+    if action is None:
+        if not create:
+            return [None] * 3
+        action = bpy.data.actions.new(f"{armature.name}_Mouth")
+        anim_data.action = action
+    if hasattr(anim_data, "action_slot"):
+        # Slotted actions keep their F-curves in a channelbag per slot
+        from bpy_extras import anim_utils
+        slot = anim_data.action_slot
+        if slot is None:
+            if not create:
+                return [None] * 3
+            slot = action.slots.new(id_type='OBJECT', name=armature.name)
+            anim_data.action_slot = slot
+        if create:
+            channelbag = anim_utils.action_ensure_channelbag_for_slot(action, slot)
+        else:
+            channelbag = anim_utils.action_get_channelbag_for_slot(action, slot)
+            if channelbag is None:
+                return [None] * 3
+        fcurves = channelbag.fcurves
+    else:
+        fcurves = action.fcurves
+    curves = [fcurves.find(PUCK_LOCATION_PATH, index=index) for index in range(3)]
+    if create:
+        curves = [fcurve or fcurves.new(PUCK_LOCATION_PATH, index=index) for index, fcurve in enumerate(curves)]
+    return curves
+
+def read_keyframes(fcurve):
+    """Frames, values and interpolations of every key of an F-curve, one foreach_get each"""
+    points = fcurve.keyframe_points
+    co = np.empty(len(points) * 2, dtype=np.float32)
+    interpolation = np.empty(len(points), dtype=np.int32)
+    points.foreach_get("co", co)
+    points.foreach_get("interpolation", interpolation)
+    return co[0::2], co[1::2], interpolation
+
+def write_keyframes(fcurve, frames, values, interpolation):
+    """Replace every key of an F-curve in one bulk write"""
+    points = fcurve.keyframe_points
+    points.clear()
+    points.add(len(frames))
+    co = np.empty(len(frames) * 2, dtype=np.float32)
+    co[0::2] = frames
+    co[1::2] = values
+    points.foreach_set("co", co)
+    # Flat handles on the key itself, only the interpolation decides the curve
+    points.foreach_set("handle_left", co)
+    points.foreach_set("handle_right", co)
+    points.foreach_set("interpolation", np.asarray(interpolation, dtype=np.int32))
+    fcurve.update()
+
+def key_puck_cues(armature, cues, aliases):
+    """Key the puck onto the shape of every (frame, code) cue with CONSTANT keys, replacing the keys in the cues'
+    frame range. Returns the number of keys written per curve and the codes no shape was found for."""
+    shapes = resolve_cue_shapes(armature.gp_face_shapes, {code for frame, code in cues}, aliases)
+    slots = puck_slot_locations(armature)
+    mapped = [(frame, slots[shapes[code]]) for frame, code in cues if code in shapes and shapes[code] in slots]
+    unmapped = sorted({code for frame, code in cues if code not in shapes})
+    if not mapped:
+        return 0, unmapped
+
+    frames = np.array([frame for frame, location in mapped], dtype=np.float32)
+    locations = np.array([tuple(location) for frame, location in mapped], dtype=np.float32)
+    for index, fcurve in enumerate(puck_fcurves(armature, create=True)):
+        old_frames, old_values, old_interpolation = read_keyframes(fcurve)
+        keep = (old_frames < frames[0]) | (old_frames > frames[-1])
+        all_frames = np.concatenate((old_frames[keep], frames))
+        order = np.argsort(all_frames, kind='stable')
+        write_keyframes(fcurve, all_frames[order],
+                        np.concatenate((old_values[keep], locations[:, index]))[order],
+                        np.concatenate((old_interpolation[keep], np.full(len(frames), KEYFRAME_CONSTANT)))[order])
+    return len(frames), unmapped
+
+
+def constant_values_at(frames, values, times):
+    """Value of a constant-interpolated curve at every time, held before the first key like Blender's extrapolation"""
+    return values[np.clip(np.searchsorted(frames, times, side='right') - 1, 0, len(values) - 1)]
+
+def puck_shapes_at(armature, locations):
+    """Shape shown for each puck location (N x 3, in the puck's rest space), resolved the way the rig's
+    switching mode resolves it. Distance rigs give the index of the shape bone the puck sits on,
+    the other modes the board slot index. -1 where no shape is shown."""
+    bones = armature.data.bones
+    puck = bones["mouth_puck_control"]
+    # The switch drivers compare world X and Z
+    matrix = np.array(armature.matrix_world, dtype=np.float64)
+    def to_world(points):
+        return points @ matrix[:3, :3].T + matrix[:3, 3]
+    puck_world = to_world(np.array(tuple(puck.head_local)) + locations @ np.array(puck.matrix_local.to_3x3()).T)
+
+    gp_obj = get_rig_object_by_role(get_rig_id(armature), "Grease Pencil Main Shape")
+    mode = rig_shape_switch_mode(armature, gp_obj) if gp_obj else armature.get("shape_switch_mode", 'DISTANCE')
+    if mode == 'DISTANCE':
+        names = [record.bone_name for record in armature.gp_face_shapes if record.bone_name in bones]
+        if not names:
+            return np.full(len(locations), -1)
+        bone_world = to_world(np.array([tuple(bones[name].head_local) for name in names]))
+        # Same test as the layer drivers, a shape shows while the puck is within 0.1 of its bone on X and Z
+        near = ((np.abs(puck_world[:, None, 0] - bone_world[None, :, 0]) <= 0.1)
+                & (np.abs(puck_world[:, None, 2] - bone_world[None, :, 2]) <= 0.1))
+        return np.where(near.any(axis=1), near.argmax(axis=1), -1)
+
+    # Same clamped grid as the "active_shape_index" driver
+    (offset_x, offset_z), (spacing_x, spacing_z), columns = rig_board_layout(armature)
+    board_world = to_world(np.array(tuple(bones["shape_board_bone"].head_local)))
+    column = np.clip(np.floor((puck_world[:, 0] - board_world[0] - offset_x) / spacing_x + 0.5), 0, columns - 1)
+    row = np.maximum(np.floor((offset_z - (puck_world[:, 2] - board_world[2])) / spacing_z + 0.5), 0)
+    return (column + row * columns).astype(np.int64)
+
+def reduce_puck_keys(armature):
+    """Keep only the puck keys that change the resolved shape and make them CONSTANT.
+    Returns the number of keys before and after."""
+    curves = puck_fcurves(armature)
+    keys = [read_keyframes(fcurve) if fcurve else None for fcurve in curves]
+    total = sum(len(key[0]) for key in keys if key)
+    if not total:
+        return 0, 0
+    if not len(armature.gp_face_shapes):
+        return total, total
+
+    # Puck location at every frame any axis is keyed, axes without keys keep the pose value
+    times = np.unique(np.concatenate([key[0] for key in keys if key and len(key[0])]))
+    rest = armature.pose.bones["mouth_puck_control"].location
+    location = np.empty((len(times), 3), dtype=np.float32)
+    for axis, key in enumerate(keys):
+        if key and len(key[0]):
+            location[:, axis] = constant_values_at(key[0], key[1], times)
+        else:
+            location[:, axis] = rest[axis]
+
+    shapes = puck_shapes_at(armature, location)
+    keep = np.r_[True, shapes[1:] != shapes[:-1]]
+
+    remaining = 0
+    for axis, fcurve in enumerate(curves):
+        if fcurve is None or not len(keys[axis][0]):
+            continue
+        # Held values only need a key where this axis actually moves
+        values = location[keep, axis]
+        moves = np.r_[True, values[1:] != values[:-1]]
+        write_keyframes(fcurve, times[keep][moves], values[moves], np.full(int(moves.sum()), KEYFRAME_CONSTANT))
+        remaining += int(moves.sum())
+    return total, remaining
+
+
+class MY_OT_reduce_puck_keys(bpy.types.Operator):
+    """Remove mouth puck keys that don't change the shown shape and make the remaining keys constant"""
+    bl_idname = "my.reduce_puck_keys"
+    bl_label = "Clean Up Puck Keys"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @classmethod
+    def poll(cls, context):
+        return get_target_face_rig(context) is not None
+
+    def execute(self, context):
+        armature = get_target_face_rig(context)
+        before, after = reduce_puck_keys(armature)
+        if not before:
+            self.report({'WARNING'}, f"The mouth puck of {armature.name} has no keys")
+            return {'CANCELLED'}
+        self.report({'INFO'}, f"Removed {before - after} of {before} puck keys, the remaining {after} are constant.")
+        return {'FINISHED'}
+
+
+class MY_OT_import_lip_sync(bpy.types.Operator):
+    """Key the mouth puck from a Rhubarb (.tsv) or Papagayo/MOHO (.dat) mouth cue file"""
+    bl_idname = "my.import_lip_sync"
+    bl_label = "Import Lip Sync"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    filepath: bpy.props.StringProperty(subtype='FILE_PATH')
+    filter_glob: bpy.props.StringProperty(default="*.tsv;*.txt;*.dat", options={'HIDDEN'})
+    start_frame: bpy.props.IntProperty(name="Start Frame", description="Frame the audio starts on", default=1)
+
+    @classmethod
+    def poll(cls, context):
+        return get_target_face_rig(context) is not None
+
+    def invoke(self, context, event):
+        self.start_frame = context.scene.frame_start
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+    def execute(self, context):
+        armature = get_target_face_rig(context)
+        scene = context.scene
+        try:
+            cues, aliases = parse_lip_sync_file(bpy.path.abspath(self.filepath),
+                                                scene.render.fps / scene.render.fps_base, self.start_frame)
+        except (OSError, UnicodeDecodeError) as error:
+            self.report({'ERROR'}, f"Could not read {self.filepath}: {error}")
+            return {'CANCELLED'}
+        if not cues:
+            self.report({'WARNING'}, "No mouth cues found in the file")
+            return {'CANCELLED'}
+
+        keyed, unmapped = key_puck_cues(armature, cues, aliases)
+        if unmapped:
+            self.report({'WARNING'}, f"No mouth shape named for: {', '.join(unmapped)} - those cues were skipped")
+        if not keyed:
+            return {'CANCELLED'}
+        self.report({'INFO'}, f"Keyed {keyed} mouth cues from frame {cues[0][0]} to {cues[-1][0]}.")
+        return {'FINISHED'}
+
+
+############################### Audio Visemes ########################
+
+# Shapes tried for every estimated viseme, same matching as the lip sync cues
+VISEME_SHAPE_ALIASES = {
+    "closed": ("Closed", "MBP", "M", "Rest", "X", "A"),
+    "open": ("Open", "AI", "D", "Ah"),
+    "wide": ("Wide", "E", "EE", "C", "etc", "B"),
+    "round": ("Round", "O", "U", "OO", "WQ", "F"),
+}
+# Spectral bands in Hz, low carries rounded vowels, high carries spread lips and sibilants
+VISEME_LOW_BAND = (100, 900)
+VISEME_HIGH_BAND = (2500, 6000)
+
+def decode_pcm(data, sample_width, channels):
+    """Mono float samples in -1..1 from raw little-endian PCM frames"""
+    if sample_width == 1:
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif sample_width == 2:
+        samples = np.frombuffer(data, dtype="<i2").astype(np.float32) / 32768
+    elif sample_width == 3:
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        values = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+        samples = np.where(values & 0x800000, values - 0x1000000, values).astype(np.float32) / 8388608
+    elif sample_width == 4:
+        samples = np.frombuffer(data, dtype="<i4").astype(np.float32) / 2147483648
+    else:
+        raise ValueError(f"Unsupported sample width: {sample_width} bytes")
+    return samples.reshape(-1, channels).mean(axis=1)
+
+def wav_frame_features(path, fps, chunk_frames=240):
+    """RMS energy and spectral tilt (log of high band over low band power) of every animation frame of a PCM WAV file.
+    The file is read chunk_frames animation frames at a time, so it is never loaded whole."""
+    energies = []
+    tilts = []
+    with wave.open(path, "rb") as wav:
+        if wav.getcomptype() != 'NONE':
+            raise ValueError("Only uncompressed PCM WAV files are supported")
+        channels, sample_width, rate = wav.getnchannels(), wav.getsampwidth(), wav.getframerate()
+        samples_per_frame = rate / fps
+        window_size = max(int(samples_per_frame), 2)
+        window = np.hanning(window_size).astype(np.float32)
+        frequencies = np.fft.rfftfreq(window_size, 1 / rate)
+        low = (frequencies >= VISEME_LOW_BAND[0]) & (frequencies < VISEME_LOW_BAND[1])
+        high = (frequencies >= VISEME_HIGH_BAND[0]) & (frequencies < VISEME_HIGH_BAND[1])
+
+        pending = np.empty(0, dtype=np.float32)
+        consumed = 0
+        frame_index = 0
+        while True:
+            data = wav.readframes(int(samples_per_frame * chunk_frames) + 1)
+            if data:
+                pending = np.concatenate((pending, decode_pcm(data, sample_width, channels)))
+            # Every frame whose samples are all in, or whatever is left once the file ends
+            available = (consumed + len(pending)) / samples_per_frame
+            frame_count = int(available) if data else math.ceil(available - 1e-9)
+            frame_count -= frame_index
+            if frame_count > 0 and len(pending):
+                bounds = np.round((frame_index + np.arange(frame_count + 1)) * samples_per_frame).astype(np.int64) - consumed
+                bounds = np.clip(bounds, 0, len(pending))
+                starts, ends = np.minimum(bounds[:-1], len(pending) - 1), bounds[1:]
+                # Summed up to the last frame's end only, the rest of pending belongs to the next chunk
+                head = pending[:max(int(ends[-1]), int(starts[-1]) + 1)]
+                squares = np.add.reduceat(head * head, starts)
+                energies.append(np.sqrt(squares / np.maximum(ends - starts, 1)))
+
+                # One windowed spectrum per frame, all frames at once
+                padded = np.concatenate((pending, np.zeros(window_size, dtype=np.float32)))
+                frames = padded[starts[:, None] + np.arange(window_size)] * window
+                power = np.abs(np.fft.rfft(frames, axis=1)) ** 2
+                tilts.append(np.log((power[:, high].sum(axis=1) + 1e-9) / (power[:, low].sum(axis=1) + 1e-9)))
+
+                frame_index += frame_count
+                drop = int(ends[-1])
+                pending = pending[drop:]
+                consumed += drop
+            if not data:
+                break
+    if not energies:
+        return np.empty(0), np.empty(0)
+    return np.concatenate(energies), np.concatenate(tilts)
+
+def classify_visemes(energy, tilt, silence_db=30.0):
+    """closed for silent frames, then round, open or wide for the lowest, middle and highest spectral tilt"""
+    codes = np.full(len(energy), "closed", dtype=object)
+    if not len(energy):
+        return codes
+    loudness = 20 * np.log10(energy + 1e-9)
+    voiced = loudness > loudness.max() - silence_db
+    if voiced.any():
+        low, high = np.percentile(tilt[voiced], (30, 70))
+        codes[voiced] = "open"
+        codes[voiced & (tilt <= low)] = "round"
+        codes[voiced & (tilt >= high)] = "wide"
+    return codes
+
+def viseme_cues(codes, start_frame=1, min_hold=2):
+    """(frame, viseme) cues for every change of viseme. Runs shorter than min_hold frames keep the previous shape."""
+    if not len(codes):
+        return []
+    run_starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    run_ends = np.r_[run_starts[1:], len(codes)]
+    cues = []
+    for start, end in zip(run_starts, run_ends):
+        if cues and (end - start < min_hold or cues[-1][1] == codes[start]):
+            continue
+        cues.append((start_frame + int(start), codes[start]))
+    return cues
+
+
+class MY_OT_estimate_visemes(bpy.types.Operator):
+    """Key a rough lip sync pass on the mouth puck from a WAV file's loudness and spectrum, no external tools needed"""
+    bl_idname = "my.estimate_visemes"
+    bl_label = "Estimate Lip Sync from Audio"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    filepath: bpy.props.StringProperty(subtype='FILE_PATH')
+    filter_glob: bpy.props.StringProperty(default="*.wav", options={'HIDDEN'})
+    start_frame: bpy.props.IntProperty(name="Start Frame", description="Frame the audio starts on", default=1)
+    silence_db: bpy.props.FloatProperty(
+        name="Silence Threshold",
+        description="Frames this many decibels below the loudest one close the mouth",
+        default=30.0,
+        min=6.0,
+        max=90.0
+    )
+    min_hold: bpy.props.IntProperty(
+        name="Minimum Hold",
+        description="Shortest number of frames a shape is kept, shorter ones are skipped",
+        default=2,
+        min=1,
+        max=12
+    )
+
+    @classmethod
+    def poll(cls, context):
+        return get_target_face_rig(context) is not None
+
+    def invoke(self, context, event):
+        self.start_frame = context.scene.frame_start
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+    def execute(self, context):
+        armature = get_target_face_rig(context)
+        scene = context.scene
+        try:
+            energy, tilt = wav_frame_features(bpy.path.abspath(self.filepath), scene.render.fps / scene.render.fps_base)
+        except (OSError, EOFError, ValueError, wave.Error) as error:
+            self.report({'ERROR'}, f"Could not read {self.filepath}: {error}")
+            return {'CANCELLED'}
+        cues = viseme_cues(classify_visemes(energy, tilt, self.silence_db), self.start_frame, self.min_hold)
+        if not cues:
+            self.report({'WARNING'}, "The audio file is empty")
+            return {'CANCELLED'}
+
+        keyed, unmapped = key_puck_cues(armature, cues, VISEME_SHAPE_ALIASES)
+        if unmapped:
+            self.report({'WARNING'}, f"No mouth shape found for: {', '.join(unmapped)} - name shapes Closed/Open/Wide/Round")
+        if not keyed:
+            return {'CANCELLED'}
+        self.report({'INFO'}, f"Keyed {keyed} visemes over {len(energy)} frames.")
+        return {'FINISHED'}
+
+
+############################### Operator Profiling ########################
+
+# bl_idname -> last and accumulated numbers for the Performance panel
+_operator_profiles = {}
+# One counter dict per profiled operator currently running, outermost first
+_profile_stack = []
+_ops_call_original = None
+# Set when bpy.ops could not be hooked, the panel then shows why ops are not counted
+_ops_counter_state = {"unavailable": None}
+
+MODE_SWITCH_OPERATORS = ("mode_set", "editmode_toggle", "posemode_toggle", "paintmode_toggle")
+
+def count_datablocks():
+    total = 0
+    for name in dir(bpy.data):
+        collection = getattr(bpy.data, name, None)
+        if isinstance(collection, bpy.types.bpy_prop_collection):
+            total += len(collection)
+    return total
+
+def _counting_ops_call(self, *args, **kwargs):
+    if _profile_stack and _profile_stack[-1]["bpy_ops_calls"] is not None:
+        is_mode_switch = self._func in MODE_SWITCH_OPERATORS
+        for counters in _profile_stack:
+            counters["bpy_ops_calls"] += 1
+            counters["mode_switches"] += is_mode_switch
+    return _ops_call_original(self, *args, **kwargs)
+
+def install_ops_counter():
+    """Count bpy.ops calls by wrapping the private operator call class. Returns False when this Blender
+    version does not have it, profiling then still records time and datablocks"""
+    global _ops_call_original
+    if _ops_call_original is not None:
+        return True
+    if _ops_counter_state["unavailable"] is not None:
+        return False
+    op_class = getattr(bpy.ops, "_BPyOpsSubModOp", None)
+    if op_class is None or not hasattr(op_class, "__call__"):
+        _ops_counter_state["unavailable"] = "bpy.ops has no _BPyOpsSubModOp in this Blender version"
+        return False
+    try:
+        original = op_class.__call__
+        op_class.__call__ = _counting_ops_call
+    except (AttributeError, TypeError) as error:
+        _ops_counter_state["unavailable"] = str(error)
+        return False
+    _ops_call_original = original
+    return True
+
+def remove_ops_counter():
+    global _ops_call_original
+    if _ops_call_original is not None:
+        try:
+            bpy.ops._BPyOpsSubModOp.__call__ = _ops_call_original
+        except (AttributeError, TypeError):
+            pass
+        _ops_call_original = None
+
+def record_operator_profile(idname, seconds, counters, datablocks_created, result, settings):
+    profile = _operator_profiles.setdefault(idname, {"calls": 0, "total_seconds": 0.0})
+    profile["calls"] += 1
+    profile["total_seconds"] += seconds
+    profile["last_seconds"] = seconds
+    profile["bpy_ops_calls"] = counters["bpy_ops_calls"]
+    profile["mode_switches"] = counters["mode_switches"]
+    profile["datablocks_created"] = datablocks_created
+
+    if settings.profile_log and settings.profile_log_path:
+        # None means the ops count was unavailable, the log keeps that as null
+        entry = {
+            "operator": idname,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "blend_file": bpy.data.filepath,
+            "seconds": round(seconds, 6),
+            "bpy_ops_calls": counters["bpy_ops_calls"],
+            "mode_switches": counters["mode_switches"],
+            "datablocks_created": datablocks_created,
+            "result": sorted(result) if isinstance(result, set) else str(result),
+        }
+        try:
+            with open(bpy.path.abspath(settings.profile_log_path), "a") as log_file:
+                log_file.write(json.dumps(entry) + "\n")
+        except OSError as error:
+            return f"Could not write the profile log: {error}"
+    return None
+
+def profile_operator(cls):
+    """Wrap an operator's execute so it is measured while profiling is enabled"""
+    execute = cls.execute
+    if getattr(execute, "is_profiled", False):
+        return
+
+    @functools.wraps(execute)
+    def profiled_execute(self, context):
+        settings = getattr(context.scene, "grease_pencil_face_rig_settings", None)
+        if settings is None or not settings.profile_operators:
+            return execute(self, context)
+        if install_ops_counter():
+            counters = {"bpy_ops_calls": 0, "mode_switches": 0}
+        else:
+            counters = {"bpy_ops_calls": None, "mode_switches": None}
+        datablocks = count_datablocks()
+        _profile_stack.append(counters)
+        start = time.perf_counter()
+        try:
+            result = execute(self, context)
+        finally:
+            seconds = time.perf_counter() - start
+            _profile_stack.pop()
+        log_error = record_operator_profile(cls.bl_idname, seconds, counters, count_datablocks() - datablocks, result, settings)
+        if log_error:
+            self.report({'WARNING'}, log_error)
+        return result
+
+    profiled_execute.is_profiled = True
+    cls.execute = profiled_execute
+
+
+class MY_OT_reset_operator_profiles(bpy.types.Operator):
+    """Clear the recorded operator timings"""
+    bl_idname = "my.reset_operator_profiles"
+    bl_label = "Reset Profiles"
+
+    def execute(self, context):
+        _operator_profiles.clear()
+        return {'FINISHED'}
+
+
+############################### Headless Workflow ########################
+
+def add_drawing_strokes(drawing, strokes, radius=0.005):
+    """Append strokes, given as lists of (x, y, z) points, to a Grease Pencil drawing in one bulk write"""
+    strokes = [stroke for stroke in strokes if len(stroke)]
+    if not strokes:
+        return
+    point_start = len(drawing.attributes["position"].data)
+    drawing.add_strokes([len(stroke) for stroke in strokes])
+
+    positions = drawing.attributes["position"]
+    co = np.empty(len(positions.data) * 3, dtype=np.float32)
+    positions.data.foreach_get("vector", co)
+    co[point_start * 3:] = np.concatenate([np.asarray(stroke, dtype=np.float32).reshape(-1) for stroke in strokes])
+    positions.data.foreach_set("vector", co)
+
+    radii = drawing.attributes.get("radius")
+    if radii is None:
+        radii = drawing.attributes.new("radius", 'FLOAT', 'POINT')
+    values = np.empty(len(radii.data), dtype=np.float32)
+    radii.data.foreach_get("value", values)
+    values[point_start:] = radius
+    radii.data.foreach_set("value", values)
+    drawing.tag_positions_changed()
+
+def run_mouth_workflow(context, shapes=None, rig_name="Character", shape_switch_mode=None):
+    """Run the mouth workflow without a UI and return the seconds spent in each step.
+    shapes is a list of {"name": str, "strokes": [[(x, y, z), ...], ...]}. Without it the file has to hold a
+    drawing session that was saved after finishing its mouth shapes."""
+    timings = {}
+
+    def step(name, operator, **kwargs):
+        start = time.perf_counter()
+        result = operator(**kwargs)
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+        if 'FINISHED' not in result:
+            raise RuntimeError(f"{name} did not finish: {result}")
+
+    settings = context.scene.grease_pencil_face_rig_settings
+    if shape_switch_mode:
+        settings.shape_switch_mode = shape_switch_mode
+
+    if shapes is not None:
+        step("SetUp", bpy.ops.view3d.setup)
+        step("ViewCenterOriginMouths", bpy.ops.view3d.center_origin)
+        for shape in shapes:
+            gp_obj = context.view_layer.objects.active
+            layer = gp_obj.data.layers.active
+            frame_number = context.scene.frame_current
+            frame = layer.get_frame_at(frame_number)
+            if frame is None or frame.frame_number != frame_number:
+                frame = layer.frames.new(frame_number)
+            add_drawing_strokes(frame.drawing, shape["strokes"])
+            settings.mouth_shape_name = shape["name"]
+            step("FinishMouthShape", bpy.ops.grease_pencil.finish_mouth_shape)
+    else:
+        gp_obj = bpy.data.objects.get("GP Temp Face Object")
+        if gp_obj is None or not context.scene.has_setup_been_run:
+            raise RuntimeError("No mouth drawing session found in this file")
+        if context.mode != 'OBJECT':
+            bpy.ops.object.mode_set(mode='OBJECT')
+        for obj in context.selected_objects:
+            obj.select_set(False)
+        context.view_layer.objects.active = gp_obj
+        gp_obj.select_set(True)
+        bpy.ops.object.mode_set(mode='PAINT_GREASE_PENCIL')
+
+    step("GPDoneDrawingMouth", bpy.ops.grease_pencil.done_drawing)
+    step("CreateRig", bpy.ops.object.create_rig, rig_name=rig_name)
+    return timings
+
+
 class MY_OT_apply_shrinkwrap(bpy.types.Operator):
     """Bind the face rig to a 3D object using the vertex group created from the grease pencil layers"""
     bl_idname = "my.apply_shrinkwrap"
@@ -2299,10 +4089,8 @@ class MY_OT_onion_navigate(bpy.types.Operator):
         if not collection:
             self.report({'ERROR'}, "Collection 'Mouth Rig Control Board Objects' not found.")
             return {'CANCELLED'}
-        gp_duplicates = [obj for obj in collection.objects if obj.type == 'GREASEPENCIL']
-        
         new_index = settings.onion_preview_index + self.direction
-        settings.onion_preview_index = max(0, min(new_index, len(gp_duplicates) - 1))
+        settings.onion_preview_index = max(0, min(new_index, len(get_board_shape_names()) - 1))
         
         return {'FINISHED'}
     
@@ -2371,6 +4159,9 @@ class MY_OT_append_to_rig_permanent(bpy.types.Operator):
         self.report({'INFO'}, f"Positioned face rig at head bone location: {head_world}")
         
         
+        # The face rig object goes away in the join, its shape records move to the target rig
+        copy_shape_records(face_rig.gp_face_shapes, target_rig.gp_face_shapes)
+
         bpy.ops.object.select_all(action='DESELECT')
         face_rig.select_set(True)
         target_rig.select_set(True)
@@ -2649,13 +4440,9 @@ class GP_PT_Face_Rig_Workflow_Panel(Panel, GPFaceRigPanel):
         has_setup = scn.has_setup_been_run
         has_rig = scn.rig_created
 
-        collection = bpy.data.collections.get("Mouth Rig Control Board Objects")
-        has_mouth_shapes = bool(
-            collection and any(o.type == 'GREASEPENCIL' for o in collection.objects)
-        )
+        ui_state = get_ui_state(context)
+        has_mouth_shapes = ui_state["has_mouth_shapes"]
         
-        lattice = bpy.data.objects.get("GPMouthLattice")
-        rig = bpy.data.objects.get("GP Mouth Rig")
         rig_settings = context.scene.target_rig_settings
         shrinkwrap_settings = context.scene.shrinkwrap_settings
 
@@ -2705,6 +4492,10 @@ class GP_PT_Face_Rig_Workflow_Panel(Panel, GPFaceRigPanel):
         box.operator(FinishMouthShape.bl_idname, text="Finish Mouth Shape", icon='CHECKMARK')
         
         box.separator()
+        box.prop(settings, "merge_shape_labels")
+        row = box.row(align=True)
+        row.prop(settings, "board_columns", text="Columns")
+        row.prop(settings, "board_padding", text="Padding")
         box.operator(GPDoneDrawingMouth.bl_idname, text="Done Drawing", icon='EXPORT')
 
         # Onion skinning — only show if there are shapes to preview
@@ -2715,13 +4506,18 @@ class GP_PT_Face_Rig_Workflow_Panel(Panel, GPFaceRigPanel):
             row.prop(settings, "use_onion_skinning", text="Onion Preview", toggle=True, icon=icon)
 
             if settings.use_onion_skinning:
+                box.row().prop(settings, "onion_mode", expand=True)
                 col = box.column(align=True)
                 col.prop(settings, "onion_preview_index", text="Shape", slider=False)
+                if settings.onion_mode == 'MULTI':
+                    col.prop(settings, "onion_range")
+                    col.prop(settings, "onion_falloff", slider=True)
+                    col.row(align=True).prop(settings, "onion_placement", expand=True)
                 
-                gp_duplicates = [o for o in collection.objects if o.type == 'GREASEPENCIL']
+                shape_names = ui_state["shape_names"]
                 idx = settings.onion_preview_index
-                if gp_duplicates and 0 <= idx < len(gp_duplicates):
-                    col.label(text=f"Showing: {gp_duplicates[idx].name}", icon='GREASEPENCIL')
+                if shape_names and 0 <= idx < len(shape_names):
+                    col.label(text=f"Showing: {shape_names[idx]}", icon='GREASEPENCIL')
 
                 row = box.row(align=True)
                 op_prev = row.operator("my.onion_navigate", text="Previous", icon='TRIA_LEFT')
@@ -2749,6 +4545,15 @@ class GP_PT_Face_Rig_Workflow_Panel(Panel, GPFaceRigPanel):
         row.enabled = has_setup and not is_drawing  # grey if not ready or still drawing
         row.operator(CreateRig.bl_idname, text="Create Rig", icon='ARMATURE_DATA')
 
+        if has_rig:
+            box.separator()
+            box.label(text="Add a Shape to the Finished Rig:")
+            box.prop(settings, "mouth_shape_name", text="")
+            row = box.row(align=True)
+            row.operator(MY_OT_draw_rig_shape.bl_idname, text="Draw New Shape", icon='GREASEPENCIL')
+            row.operator(MY_OT_add_shape_to_rig.bl_idname, text="Add Shape to Rig", icon='ADD')
+            row.operator(MY_OT_cancel_rig_shape.bl_idname, text="", icon='X')
+
         # -------------------------
         # STEP 5 — Append to existing rig
         # -------------------------
@@ -2760,7 +4565,7 @@ class GP_PT_Face_Rig_Workflow_Panel(Panel, GPFaceRigPanel):
         col = box.column()
         col.enabled = has_rig  # grey until rig is created
 
-        rig = find_rig(context)
+        rig = ui_state["face_rig_name"]
         col.alert = True
         col.label(text="Please only click ONE of the buttons below.", icon='ERROR')
         col.alert = False
@@ -2818,6 +4623,7 @@ class GP_PT_Face_Rig_Workflow_Panel(Panel, GPFaceRigPanel):
                 MY_OT_apply_shrinkwrap.bl_idname, 
                 text="Apply Shrinkwrap Modifier"
             )
+            lattice = bpy.data.objects.get(ui_state["lattice_name"]) if ui_state["lattice_name"] else None
             if lattice and lattice.modifiers.get("Shrinkwrap"):
                 col.label(text="Use 'Above Surface' to prevent clipping", icon='INFO')
             else:
@@ -2825,6 +4631,39 @@ class GP_PT_Face_Rig_Workflow_Panel(Panel, GPFaceRigPanel):
         else:
             col.label(text="Select a target mesh above", icon='INFO')              
 
+        # -------------------------
+        # STEP 7 — Lip Sync
+        # -------------------------
+
+        box = layout.box()
+        row = box.row()
+        row.label(text="7. Lip Sync (Optional)", icon='SPEAKER')
+
+        col = box.column()
+        col.enabled = has_rig
+        col.operator(MY_OT_import_lip_sync.bl_idname, text="Import Mouth Cues", icon='IMPORT')
+        col.label(text="Rhubarb .tsv or Papagayo .dat - shapes are matched by name.", icon='INFO')
+        col.operator(MY_OT_estimate_visemes.bl_idname, text="Estimate from Audio", icon='SOUND')
+        col.label(text="Rough pass from a .wav, uses shapes named Closed/Open/Wide/Round.", icon='INFO')
+        col.operator(MY_OT_reduce_puck_keys.bl_idname, text="Clean Up Puck Keys", icon='IPO_CONSTANT')
+
+        # -------------------------
+        # STEP 8 — Bake
+        # -------------------------
+
+        box = layout.box()
+        row = box.row()
+        row.label(text="8. Bake for Render (Optional)", icon='RENDER_ANIMATION')
+
+        col = box.column()
+        col.enabled = has_rig
+        col.operator(MY_OT_bake_face_animation.bl_idname, text="Bake Face Animation", icon='RENDER_ANIMATION')
+        face_rig = get_target_face_rig(context) if has_rig else None
+        if face_rig and get_rig_object_by_role(get_rig_id(face_rig), "Baked Face"):
+            col.prop(face_rig, "gp_face_use_baked", toggle=True, icon='FILE_REFRESH')
+        else:
+            col.label(text="Bakes the rig into plain drawings, one per frame, for faster renders.", icon='INFO')
+
 
 # class GP_PT_Bone_Collections_Panel(Panel, GPFaceRigPanel):
 #     """Separate class for rig UI elements to keep things organized"""
@@ -2841,7 +4680,47 @@ class GP_PT_Face_Rig_Workflow_Panel(Panel, GPFaceRigPanel):
 
 # Registration
 
+class GP_PT_Face_Rig_Performance_Panel(Panel, GPFaceRigPanel):
+    bl_label = "Performance"
+    bl_parent_id = "GP_PT_Face_Rig_Workflow_Panel"
+    bl_options = {'DEFAULT_CLOSED'}
+
+    def draw(self, context):
+        layout = self.layout
+        settings = context.scene.grease_pencil_face_rig_settings
+
+        layout.prop(settings, "profile_operators")
+        row = layout.row(align=True)
+        row.enabled = settings.profile_operators
+        row.prop(settings, "profile_log")
+        sub = row.row(align=True)
+        sub.enabled = settings.profile_log
+        sub.prop(settings, "profile_log_path", text="")
+
+        if _ops_counter_state["unavailable"]:
+            layout.label(text="ops count unavailable", icon='ERROR')
+        if not _operator_profiles:
+            layout.label(text="Run a step with profiling on to see its cost", icon='INFO')
+            return
+
+        col = layout.column(align=True)
+        header = col.row(align=True)
+        for title in ("Operator", "ms", "ops", "modes", "new IDs"):
+            header.label(text=title)
+        # Slowest steps first
+        for idname, profile in sorted(_operator_profiles.items(), key=lambda item: -item[1]["last_seconds"]):
+            row = col.row(align=True)
+            row.label(text=idname.split(".")[-1])
+            row.label(text=f"{profile['last_seconds'] * 1000:.1f}")
+            for key in ("bpy_ops_calls", "mode_switches"):
+                row.label(text="-" if profile[key] is None else str(profile[key]))
+            row.label(text=str(profile["datablocks_created"]))
+        layout.operator(MY_OT_reset_operator_profiles.bl_idname, icon='X')
+
+
 classes = (
+    MouthShapeLayer,
+    MouthShapeItem,
     GreasePencilFaceRigSettings,
     ShrinkwrapSettings,
     TargetRigSettings,
@@ -2854,6 +4733,13 @@ classes = (
     # GP_PT_Bone_Collections_Panel,
     GPAddNewLayer,
     CreateRig,
+    MY_OT_draw_rig_shape,
+    MY_OT_add_shape_to_rig,
+    MY_OT_cancel_rig_shape,
+    MY_OT_bake_face_animation,
+    MY_OT_import_lip_sync,
+    MY_OT_estimate_visemes,
+    MY_OT_reduce_puck_keys,
     MY_OT_apply_shrinkwrap,
     GPDoneDrawingMouth,
     EyeItem,
@@ -2864,16 +4750,20 @@ classes = (
     MY_OT_enter_edit_mode,
     MY_OT_append_to_rig_permanent,
     MY_OT_append_to_rig_simple,
+    MY_OT_reset_operator_profiles,
     
 )
 
 
 def update_GP_tab():
-    try:
-        bpy.utils.unregister_class(GP_PT_Face_Rig_Workflow_Panel)
-    except:
-        pass
+    for panel in (GP_PT_Face_Rig_Performance_Panel, GP_PT_Face_Rig_Workflow_Panel):
+        try:
+            bpy.utils.unregister_class(panel)
+        except:
+            pass
     bpy.utils.register_class(GP_PT_Face_Rig_Workflow_Panel)
+    # Sub-panels have to be registered after their parent
+    bpy.utils.register_class(GP_PT_Face_Rig_Performance_Panel)
     #interface_classes = (GP_PT_Face_Rig_Workflow_Panel, "")
     #for cls in interface_classes:
         #try:
@@ -2888,6 +4778,11 @@ def register():
     
     #Register prop group!
     
+    # Operators are wrapped before registration so Blender picks up the profiled execute
+    for cls in classes:
+        if issubclass(cls, bpy.types.Operator):
+            profile_operator(cls)
+
     for cls in classes:
         try:
             bpy.utils.register_class(cls)
@@ -2908,12 +4803,63 @@ def register():
     bpy.types.Scene.shrinkwrap_settings = bpy.props.PointerProperty(type=ShrinkwrapSettings)
     bpy.app.driver_namespace['get_bone_distance'] = get_bone_distance
     bpy.types.Scene.eye_collection = bpy.props.CollectionProperty(type=EyeItem)
+    bpy.types.Scene.gp_mouth_shapes = bpy.props.CollectionProperty(type=MouthShapeItem)
+    bpy.types.Object.gp_face_shapes = bpy.props.CollectionProperty(type=MouthShapeItem)
+    bpy.types.Object.gp_face_use_baked = bpy.props.BoolProperty(
+        name="Use Baked Face",
+        description="Show the baked drawings instead of evaluating the face rig",
+        default=False,
+        update=update_use_baked_face
+    )
     bpy.types.Scene.active_eye_index = bpy.props.IntProperty(default=0)
     bpy.types.Scene.use_onion_skinning = bpy.props.BoolProperty(name="Enable Onion Skinning", default=False)
     bpy.types.Scene.target_rig_settings = bpy.props.PointerProperty(type = TargetRigSettings)
     bpy.types.Scene.rig_created = bpy.props.BoolProperty(name="Rig Created", default=False)
-    
+
+    # Keep the rig registry current without rescanning bpy.data.objects
+    _rig_registry_state["dirty"] = True
+    if rig_registry_load_post not in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.append(rig_registry_load_post)
+    if rig_registry_undo_post not in bpy.app.handlers.undo_post:
+        bpy.app.handlers.undo_post.append(rig_registry_undo_post)
+        bpy.app.handlers.redo_post.append(rig_registry_undo_post)
+    if rig_registry_depsgraph_update_post not in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.append(rig_registry_depsgraph_update_post)
+    if board_state_depsgraph_update_post not in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.append(board_state_depsgraph_update_post)
+    mark_ui_state_dirty()
+    subscribe_ui_state()
+    if ui_state_load_post not in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.append(ui_state_load_post)
+    if board_state_reset_handler not in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.append(board_state_reset_handler)
+        bpy.app.handlers.undo_post.append(board_state_reset_handler)
+        bpy.app.handlers.redo_post.append(board_state_reset_handler)
+
 def unregister():
+    if rig_registry_load_post in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(rig_registry_load_post)
+    if rig_registry_undo_post in bpy.app.handlers.undo_post:
+        bpy.app.handlers.undo_post.remove(rig_registry_undo_post)
+    if rig_registry_undo_post in bpy.app.handlers.redo_post:
+        bpy.app.handlers.redo_post.remove(rig_registry_undo_post)
+    if rig_registry_depsgraph_update_post in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(rig_registry_depsgraph_update_post)
+    for handlers in (bpy.app.handlers.load_post, bpy.app.handlers.undo_post, bpy.app.handlers.redo_post):
+        if board_state_reset_handler in handlers:
+            handlers.remove(board_state_reset_handler)
+    if board_state_depsgraph_update_post in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(board_state_depsgraph_update_post)
+    if ui_state_load_post in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(ui_state_load_post)
+    bpy.msgbus.clear_by_owner(_ui_msgbus_owner)
+    if bpy.app.timers.is_registered(do_onion_update):
+        bpy.app.timers.unregister(do_onion_update)
+    _onion_state["pending"] = False
+    remove_onion_overlay()
+    remove_ops_counter()
+
+    bpy.utils.unregister_class(GP_PT_Face_Rig_Performance_Panel)
     for cls in reversed(classes):
         bpy.utils.unregister_class(cls)
 
@@ -2929,6 +4875,9 @@ def unregister():
     del bpy.types.Scene.use_onion_skinning
     del bpy.types.Scene.number_of_eyes
     del bpy.types.Scene.rig_created
+    del bpy.types.Scene.gp_mouth_shapes
+    del bpy.types.Object.gp_face_shapes
+    del bpy.types.Object.gp_face_use_baked
 
 if __name__ == "__main__":
     register()
\ No newline at end of file
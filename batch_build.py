@@ -0,0 +1,172 @@
+# Batch face rig builder for GP Face Tools
+#
+# Builds one face rig per input file, with every file in its own background Blender process:
+#
+#   blender -b --python batch_build.py -- INPUT_DIR [--output DIR] [--jobs N] [--report FILE]
+#                                          [--rig-mode MODE] [--blender PATH]
+#
+# INPUT_DIR can hold:
+#   *.blend  drawing sessions saved after finishing the mouth shapes (before "Done Drawing")
+#   *.json   shape specs: {"rig_name": "Hero", "shape_switch_mode": "INDEX",
+#                          "shapes": [{"name": "A", "strokes": [[[x, y, z], ...], ...]}, ...]}
+#
+# The finished rigs are saved to --output as <file>_rig.blend, and a JSON report with the status and
+# timings of every file is written to --report.
+
+import argparse
+import importlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+RESULT_PREFIX = "GP_FACE_RIG_RESULT "
+ADDON_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_args(argv):
+    # Blender passes its own arguments first, ours come after "--". From plain Python only the script path goes
+    argv = argv[argv.index("--") + 1:] if "--" in argv else argv[1:]
+    parser = argparse.ArgumentParser(description="Build GP face rigs for a directory of drawings")
+    parser.add_argument("input", help="Directory of drawing .blend files and/or .json shape specs")
+    parser.add_argument("--output", help="Where to save the rigged files (default: INPUT/rigs)")
+    parser.add_argument("--jobs", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="Number of Blender processes to run at once")
+    parser.add_argument("--report", help="Report file (default: OUTPUT/batch_report.json)")
+    parser.add_argument("--rig-mode", choices=['DISTANCE', 'INDEX', 'FRAMES', 'GEONODES'],
+                        help="Shape switching mode, overrides the one saved in the file or spec")
+    parser.add_argument("--blender", help="Blender executable for the workers (default: the one running this script)")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def blender_binary(args):
+    if args.blender:
+        return args.blender
+    try:
+        import bpy
+        return bpy.app.binary_path
+    except ImportError:
+        return os.environ.get("BLENDER", "blender")
+
+
+def collect_inputs(directory):
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name.lower().endswith((".blend", ".json")))
+
+
+def output_path(args, path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(args.output, f"{name}_rig.blend")
+
+
+######################## Coordinator ########################
+
+def run_worker(args, path):
+    """Build one file in its own Blender process and return its report entry"""
+    command = [blender_binary(args), "-b", "--factory-startup"]
+    if path.lower().endswith(".blend"):
+        command.append(path)
+    command += ["--python", os.path.abspath(__file__), "--", path, "--worker", "--output", args.output]
+    if args.rig_mode:
+        command += ["--rig-mode", args.rig_mode]
+
+    entry = {"file": path, "output": output_path(args, path), "status": "FAILED"}
+    start = time.perf_counter()
+    try:
+        process = subprocess.run(command, capture_output=True, text=True)
+    except OSError as error:
+        entry["message"] = str(error)
+        return entry
+    entry["seconds"] = round(time.perf_counter() - start, 3)
+
+    for line in process.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            entry.update(json.loads(line[len(RESULT_PREFIX):]))
+            break
+    else:
+        # The worker died before reporting anything
+        entry["message"] = (process.stderr or process.stdout).strip()[-2000:]
+    entry["returncode"] = process.returncode
+    return entry
+
+
+def run_batch(args):
+    inputs = collect_inputs(args.input)
+    os.makedirs(args.output, exist_ok=True)
+    print(f"Building {len(inputs)} face rigs with {args.jobs} Blender processes")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        results = list(pool.map(lambda path: run_worker(args, path), inputs))
+    for entry in results:
+        print(f"{entry['status']:8} {entry.get('seconds', 0):8.2f}s  {os.path.basename(entry['file'])}")
+
+    report = {
+        "input": os.path.abspath(args.input),
+        "jobs": args.jobs,
+        "seconds": round(time.perf_counter() - start, 3),
+        "built": sum(entry["status"] == "OK" for entry in results),
+        "failed": sum(entry["status"] != "OK" for entry in results),
+        "files": results,
+    }
+    with open(args.report, "w") as report_file:
+        json.dump(report, report_file, indent=2)
+    print(f"Report written to {args.report}")
+    return 1 if report["failed"] else 0
+
+
+######################## Worker (inside Blender) ########################
+
+def load_addon():
+    import bpy
+    # The add-on is imported as a package, from the folder it sits in
+    if os.path.dirname(ADDON_DIR) not in sys.path:
+        sys.path.insert(0, os.path.dirname(ADDON_DIR))
+    addon = importlib.import_module(os.path.basename(ADDON_DIR))
+    if not hasattr(bpy.types.Scene, "grease_pencil_face_rig_settings"):
+        addon.register()
+    return addon
+
+
+def build_one(args):
+    import bpy
+    path = args.input
+    result = {"status": "FAILED"}
+    try:
+        addon = load_addon()
+        context = bpy.context
+        if path.lower().endswith(".json"):
+            with open(path) as spec_file:
+                spec = json.load(spec_file)
+            rig_name = spec.get("rig_name") or os.path.splitext(os.path.basename(path))[0]
+            timings = addon.run_mouth_workflow(context, spec["shapes"], rig_name,
+                                               args.rig_mode or spec.get("shape_switch_mode"))
+        else:
+            rig_name = os.path.splitext(os.path.basename(path))[0]
+            timings = addon.run_mouth_workflow(context, None, rig_name, args.rig_mode)
+        bpy.ops.wm.save_as_mainfile(filepath=output_path(args, path), copy=True)
+        result.update(status="OK", rig_name=rig_name, timings={k: round(v, 4) for k, v in timings.items()})
+    except Exception as error:
+        result["message"] = f"{type(error).__name__}: {error}"
+    print(RESULT_PREFIX + json.dumps(result), flush=True)
+
+
+def main(argv):
+    args = parse_args(argv)
+    if not args.output:
+        args.output = os.path.join(args.input if not args.worker else os.path.dirname(args.input), "rigs")
+    if args.worker:
+        build_one(args)
+        return 0
+    if not args.report:
+        args.report = os.path.join(args.output, "batch_report.json")
+    return run_batch(args)
+
+
+if __name__ == "__main__":
+    exit_code = main(sys.argv)
+    if exit_code:
+        sys.exit(exit_code)
@@ -0,0 +1,184 @@
+# Benchmark for the GP Face Tools mouth rig workflow
+#
+# Runs SetUp -> ViewCenterOriginMouths -> FinishMouthShape xN -> GPDoneDrawingMouth -> CreateRig on synthetic
+# mouth shapes, each shape count in a fresh background Blender process, and writes the results to JSON:
+#
+#   blender -b --python benchmark.py -- [--shapes 10 50 200] [--rig-mode MODE] [--output FILE]
+#                                       [--playback-frames 120] [--blender PATH]
+#
+# Every run records wall time per operator, peak memory, object and datablock counts, and the time it
+# takes to evaluate the rig over a range of frames while the puck moves across the board.
+
+import argparse
+import ast
+import importlib.util
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+
+ADDON_DIR = os.path.dirname(os.path.abspath(__file__))
+# Loaded from its file, with the add-on folder itself kept off sys.path so the add-on imports as a package
+_spec = importlib.util.spec_from_file_location("batch_build", os.path.join(ADDON_DIR, "batch_build.py"))
+batch_build = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(batch_build)
+
+RESULT_PREFIX = "GP_FACE_RIG_BENCHMARK "
+
+
+def parse_args(argv):
+    # Blender passes its own arguments first, ours come after "--". From plain Python only the script path goes
+    argv = argv[argv.index("--") + 1:] if "--" in argv else argv[1:]
+    parser = argparse.ArgumentParser(description="Benchmark the GP face rig workflow")
+    parser.add_argument("--shapes", type=int, nargs="+", default=[10, 50, 200], help="Shape counts to run")
+    parser.add_argument("--rig-mode", default='DISTANCE', choices=['DISTANCE', 'INDEX', 'FRAMES', 'GEONODES'])
+    parser.add_argument("--points", type=int, default=64, help="Points per synthetic stroke")
+    parser.add_argument("--playback-frames", type=int, default=120)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--blender", help="Blender executable (default: the one running this script)")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def synthetic_shapes(count, points):
+    """Mouth-like shapes: an outer lip ellipse and an inner line, different for every shape"""
+    shapes = []
+    for index in range(count):
+        openness = 0.01 + 0.04 * ((index * 7) % 11) / 10
+        width = 0.05 + 0.03 * ((index * 5) % 7) / 6
+        outer = [(math.cos(2 * math.pi * i / (points - 1)) * width, 0.0,
+                  math.sin(2 * math.pi * i / (points - 1)) * openness) for i in range(points)]
+        inner = [((i / (points - 1) - 0.5) * width * 1.6, 0.0,
+                  math.sin(math.pi * i / (points - 1)) * openness * 0.3) for i in range(points)]
+        shapes.append({"name": f"Shape_{index:03d}", "strokes": [outer, inner]})
+    return shapes
+
+
+def peak_memory_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def datablock_counts(bpy):
+    counts = {}
+    for attribute in dir(bpy.data):
+        collection = getattr(bpy.data, attribute, None)
+        if isinstance(collection, bpy.types.bpy_prop_collection) and attribute != "window_managers":
+            counts[attribute] = len(collection)
+    return {name: count for name, count in counts.items() if count}
+
+
+######################## Worker (inside Blender) ########################
+
+def measure_playback(bpy, addon, frames):
+    """Key the puck across the shape slots and time a frame-by-frame evaluation of the rig"""
+    scene = bpy.context.scene
+    armature = addon.find_rig(bpy.context)
+    puck = armature.pose.bones.get("mouth_puck_control") if armature else None
+    if puck is None:
+        return None
+    shape_bones = [bone for bone in armature.pose.bones if bone.name.endswith("_Shape_Bone")]
+    if not shape_bones:
+        return None
+
+    # The puck holds each shape for four frames
+    for frame in range(1, frames + 1):
+        puck.matrix = shape_bones[(frame // 4) % len(shape_bones)].matrix.copy()
+        puck.keyframe_insert("location", frame=frame)
+
+    start = time.perf_counter()
+    for frame in range(1, frames + 1):
+        scene.frame_set(frame)
+    elapsed = time.perf_counter() - start
+    return {"frames": frames, "seconds": round(elapsed, 4), "ms_per_frame": round(elapsed * 1000 / frames, 3)}
+
+
+def run_benchmark(args):
+    import bpy
+    count = args.shapes[0]
+    result = {"shapes": count, "status": "FAILED"}
+    try:
+        addon = batch_build.load_addon()
+        shapes = synthetic_shapes(count, args.points)
+        start = time.perf_counter()
+        timings = addon.run_mouth_workflow(bpy.context, shapes, "Benchmark", args.rig_mode)
+        result["total_seconds"] = round(time.perf_counter() - start, 4)
+        result["operator_seconds"] = {name: round(seconds, 4) for name, seconds in timings.items()}
+        result["finish_mouth_shape_mean_seconds"] = round(timings["FinishMouthShape"] / count, 5)
+        result["objects"] = len(bpy.data.objects)
+        result["datablocks"] = datablock_counts(bpy)
+        result["playback"] = measure_playback(bpy, addon, args.playback_frames)
+        result["peak_memory_mb"] = peak_memory_mb()
+        result["status"] = "OK"
+    except Exception as error:
+        result["message"] = f"{type(error).__name__}: {error}"
+        result["peak_memory_mb"] = peak_memory_mb()
+    print(RESULT_PREFIX + json.dumps(result), flush=True)
+
+
+######################## Coordinator ########################
+
+def read_bl_info():
+    # Parsed rather than imported, so the coordinator also runs from plain Python
+    with open(os.path.join(ADDON_DIR, "__init__.py")) as addon_file:
+        tree = ast.parse(addon_file.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(t, "id", None) == "bl_info" for t in node.targets):
+            return ast.literal_eval(node.value)
+    return {}
+
+
+def run_one(args, count):
+    command = [batch_build.blender_binary(args), "-b", "--factory-startup",
+               "--python", os.path.abspath(__file__), "--", "--worker", "--shapes", str(count),
+               "--rig-mode", args.rig_mode, "--points", str(args.points),
+               "--playback-frames", str(args.playback_frames)]
+    process = subprocess.run(command, capture_output=True, text=True)
+    for line in process.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    return {"shapes": count, "status": "FAILED", "message": (process.stderr or process.stdout).strip()[-2000:]}
+
+
+def main(argv):
+    args = parse_args(argv)
+    if args.worker:
+        run_benchmark(args)
+        return 0
+
+    bl_info = read_bl_info()
+
+    runs = []
+    for count in args.shapes:
+        print(f"Benchmarking {count} shapes ({args.rig_mode})...")
+        run = run_one(args, count)
+        print(f"  {run['status']}  {run.get('total_seconds', 0):.2f}s")
+        runs.append(run)
+
+    report = {
+        "addon_version": ".".join(str(v) for v in bl_info.get("version", ())),
+        "blender": batch_build.blender_binary(args),
+        "platform": platform.platform(),
+        "rig_mode": args.rig_mode,
+        "points_per_stroke": args.points,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "runs": runs,
+    }
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"Results written to {args.output}")
+    return 0 if all(run["status"] == "OK" for run in runs) else 1
+
+
+if __name__ == "__main__":
+    exit_code = main(sys.argv)
+    if exit_code:
+        sys.exit(exit_code)